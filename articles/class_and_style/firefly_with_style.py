@@ -1,20 +1,20 @@
 import os 
-import requests 
 import json 
+import sys
+# The shared ffservices helpers live in the root of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from ffservices import client
+from ffservices.retry import raiseForStatus
+from ffservices.sweep import StyleSweep, writeManifest
 
 #Set our creds based on environment variables.
 CLIENT_ID = os.environ.get('CLIENT_ID')
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 
 def getAccessToken(id, secret):
-	response = requests.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api,ff_apis")
+	response = client.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api,ff_apis")
 	return response.json()["access_token"]
 
-def downloadFile(url, filePath):
-	with open(filePath,'wb') as output:
-		bits = requests.get(url, stream=True).content
-		output.write(bits)
-
 def textToImageWithStyle(text, style, id, token):
 
 	data = {
@@ -26,11 +26,12 @@ def textToImageWithStyle(text, style, id, token):
 	}
 
 
-	response = requests.post("https://firefly-api.adobe.io/v2/images/generate", json=data, headers = {
+	response = client.post("https://firefly-api.adobe.io/v2/images/generate", json=data, headers = {
 		"X-API-Key":id, 
 		"Authorization":f"Bearer {token}",
 		"Content-Type":"application/json"
-	}) 
+	}, idempotent=True) 
+	raiseForStatus(response)
 
 	return response.json()
 
@@ -41,11 +42,6 @@ prompt = "a cat sleeping in a sunbeam"
 
 styles = ["pastel_color","golden","antique_photo","simple"]
 
-for style in styles:
-	
-	result = textToImageWithStyle(prompt, style, CLIENT_ID, token)
-	print(f"Generated style: {style}")
-
-	fileName = f'./{result["outputs"][0]["seed"]}_{style}.jpg'
-	downloadFile(result["outputs"][0]["image"]["presignedUrl"], fileName)
-
+# All the styles are generated at once, and each one downloads as soon as it's ready
+rows = StyleSweep().run(styles, lambda style: textToImageWithStyle(prompt, style, CLIENT_ID, token), lambda style, output: f'./{output["seed"]}_{style}.jpg')
+writeManifest("./styles.json", rows, prompt=prompt)
@@ -1,12 +1,18 @@
 import os
-import requests 
-import dropbox
-from dropbox.files import CommitInfo, WriteMode
 import time 
 from slugify import slugify
+import sys
+# The shared ffservices helpers live in the root of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from ffservices import client
+from ffservices.auth import ffToken
+from ffservices.retry import raiseForStatus
+from ffservices.uploads import cachedUpload, withUpload
+from ffservices.dbx import LinkCache, dropbox_connect, dropbox_get_upload_link, dropbox_upload
+from ffservices.firefly import expandSizes
+from ffservices.photoshop import outputRender, renderPacked
 
 ff_client_id = os.environ.get('CLIENT_ID')
-ff_client_secret = os.environ.get('CLIENT_SECRET')
 db_refresh_token = os.environ.get('DROPBOX_REFRESH_TOKEN')
 db_app_key = os.environ.get('DROPBOX_APP_KEY')
 db_app_secret = os.environ.get('DROPBOX_APP_SECRET')
@@ -42,7 +48,7 @@ def createRemoveBackgroundJob(input, output, id, token):
 			"storage":"dropbox"
 		}
 	}
-	response = requests.post(f"https://image.adobe.io/sensei/cutout", headers = {"Authorization": f"Bearer {token}", "x-api-key": id }, json=data)
+	response = client.post(f"https://image.adobe.io/sensei/cutout", headers = {"Authorization": f"Bearer {token}", "x-api-key": id }, json=data)
 	return response.json()
 
 def pollJob(job, id, token):
@@ -50,7 +56,7 @@ def pollJob(job, id, token):
 	status = "" 
 	while status != 'succeeded' and status != 'failed':
 
-		response = requests.get(jobUrl, headers = {"Authorization": f"Bearer {token}", "x-api-key": id })
+		response = client.get(jobUrl, headers = {"Authorization": f"Bearer {token}", "x-api-key": id })
 		json_response = response.json()
 
 		if "status" in json_response:
@@ -63,93 +69,16 @@ def pollJob(job, id, token):
 		else:
 			return json_response
 
-def dropbox_connect(app_key, app_secret, refresh_token):
-	try:
-		dbx = dropbox.Dropbox(app_key=app_key, app_secret=app_secret, oauth2_refresh_token=refresh_token)
-	except AuthError as e:
-		print('Error connecting to Dropbox with access token: ' + str(e))
-	return dbx
-
-def dropbox_upload(f, folder):
-		newName = folder + '/' + f.split('/')[-1]
-		with open(f,'rb') as file:
-			dbx.files_upload(file.read(), newName)
-
+# Links are cached (see ffservices/dbx.py), so asking for the same one again is free
 def dropbox_get_read_link(path):
-	link = dbx.sharing_create_shared_link(path).url
-	return link.replace("dl=0","dl=1")
-
-def dropbox_get_upload_link(path):
-	commit_info = CommitInfo(path=path, mode=WriteMode.overwrite)
-	return dbx.files_get_temporary_upload_link(commit_info).link
-
-
-def getFFAccessToken(id, secret):
-	response = requests.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api,ff_apis")
-	return response.json()['access_token']
+	return links.get(path)
 
-def createOutput(psd, koProduct, sizes, sizeUrls, outputs, text, id, token):
-
-	data = {
-		"inputs": [{
-			"href":psd, 
-			"storage":"dropbox"
-		}],
-		"options":{
-			"layers":[
-			]
-		},
-		"outputs":[]
-	}
-
-	for (x,size) in enumerate(sizes):
-		width, height = size.split('x')
-		url = sizeUrls[size]
-		data["options"]["layers"].append({
-			"name":f"{width}x{height}-text",
-			"edit":{},
-			"text":{
-				"content":text
-			}
-		})
-
-		data["options"]["layers"].append({
-			"name":f"{width}x{height}-background",
-			"edit":{},
-			"input":{
-				"storage":"external", 
-				"href":url
-			}
-		})
-
-		data["options"]["layers"].append({
-			"name":f"{width}x{height}-product",
-			"edit":{},
-			"input":{
-				"storage":"external", 
-				"href":koProduct
-			}
-		})
-
-		data["outputs"].append({
-			"href":outputs[x], 
-			"storage":"dropbox",
-			"type":"image/jpeg",
-			"trimToCanvas":True,
-			"layers":[{
-				"name":f"{width}x{height}"
-			}]
-	
-		})
-
-	response = requests.post(f"https://image.adobe.io/pie/psdService/documentOperations", headers = {"Authorization": f"Bearer {token}", "x-api-key": id }, json=data)
-	return response.json()
 
 def uploadImage(path, id, token):
 	
 	with open(path,'rb') as file:
 
-		response = requests.post("https://firefly-api.adobe.io/v2/storage/image", data=file, headers = {
+		response = client.post("https://firefly-api.adobe.io/v2/storage/image", data=file, headers = {
 			"X-API-Key":id, 
 			"Authorization":f"Bearer {token}",
 			"Content-Type": "image/jpeg"
@@ -178,46 +107,28 @@ def textToImage(text, imageId, id, token):
 		}
 	}
 
-	response = requests.post("https://firefly-api.adobe.io/v3/images/generate", json=data, headers = {
+	response = client.post("https://firefly-api.adobe.io/v3/images/generate", json=data, headers = {
 		"X-API-Key":id, 
 		"Authorization":f"Bearer {token}",
 		"Content-Type":"application/json"
 	}) 
+	# So an upload id Firefly no longer has comes back as an error withUpload can spot
+	raiseForStatus(response)
 
 	return response.json()["outputs"][0]["image"]["url"]
 
-def generativeExpand(imageUrl, size, id, token):
-
-	width, height = size.split('x')
-
-	data = {
-		"numVariations":1,
-		"image":{
-			"source":{
-				"url":imageUrl
-			}
-		},
-		"size":{
-			"width":width, 
-			"height":height
-		}
-	}
-
-	response = requests.post("https://firefly-api.adobe.io/v3/images/expand", json=data, headers = {
-		"X-API-Key":id, 
-		"Authorization":f"Bearer {token}",
-		"Content-Type":"application/json"
-	})
-
-	return response.json()["outputs"][0]["image"]["url"]
-
-
 # Connect to Firefly Services and Dropbox
 dbx = dropbox_connect(db_app_key, db_app_secret, db_refresh_token)
-ff_access_token = getFFAccessToken(ff_client_id, ff_client_secret)
+links = LinkCache(dbx)
+ffToken()
 print("Connected to Firefly and Dropbox APIs.")
 
-referenceImage = uploadImage('input/source_image.jpg', ff_client_id, ff_access_token)
+# The reference image rarely changes, so reuse the last upload of it while that's still valid. If
+# Firefly drops it early, withUpload uploads it again.
+def uploadReference():
+	return uploadImage('input/source_image.jpg', ff_client_id, ffToken())
+
+cachedUpload('input/source_image.jpg', ff_client_id, uploadReference)
 print("Reference image uploaded.")
 
 # We use this to remember where are product images w/ the backgrounds are stored.
@@ -225,17 +136,18 @@ rbProducts = {}
 for product in products:
 	
 	# First, upload the source
-	dropbox_upload(f"input/products/{product}", f"{db_base_folder}input")
+	dropbox_upload(dbx, f"input/products/{product}", f"{db_base_folder}input")
 
 	# Get a readable link for that
 	readableLink = dropbox_get_read_link(f"{db_base_folder}input/{product}")
 
 	# Make a link to upload the result 
-	writableLink = dropbox_get_upload_link(f"{db_base_folder}knockout/{product}")
+	writableLink = dropbox_get_upload_link(dbx, f"{db_base_folder}knockout/{product}")
 
-	rbJob = createRemoveBackgroundJob(readableLink, writableLink, ff_client_id, ff_access_token)
-	result = pollJob(rbJob, ff_client_id, ff_access_token)
+	rbJob = createRemoveBackgroundJob(readableLink, writableLink, ff_client_id, ffToken())
+	result = pollJob(rbJob, ff_client_id, ffToken())
 
+	links.invalidate(f"{db_base_folder}knockout/{product}")
 	readableLink = dropbox_get_read_link(f"{db_base_folder}knockout/{product}")
 	rbProducts[product] = readableLink
 	# For now, we assume ok
@@ -249,22 +161,16 @@ for prompt in prompts:
 	
 	# For each prompt, generate a new background using prompt and reference
 	print(f"Generating an image with prompt: {prompt}.")
-	newImage = textToImage(prompt, referenceImage, ff_client_id, ff_access_token)
-
-	# I store a key from size to the image
-	sizeImages = {}
+	newImage = withUpload('input/source_image.jpg', ff_client_id, uploadReference, lambda referenceImage: textToImage(prompt, referenceImage, ff_client_id, ffToken()))
 
-	for (idx, size) in enumerate(sizes):
-		# For each size, outside of our first, expand it
-		if idx >= 1:
-			print(f"Generating an expanded one at size {size}")
-			expandedBackground = generativeExpand(newImage, size, ff_client_id, ff_access_token)
-			sizeImages[size] = expandedBackground
-		else:
-			print(f"Using original for {size}")
-			sizeImages[size] = newImage
+	# I store a key from size to the image. The first size is the original, the rest are all 
+	# expanded from it at the same time.
+	print(f"Generating expanded ones at sizes {', '.join(sizes[1:])}")
+	sizeImages = expandSizes(newImage, sizes, ff_client_id, ffToken(), sourceSize=sizes[0])
 
 
+	# Every language and product for this prompt, packed into as few Photoshop jobs as the template allows
+	renders = {}
 	for lang in languages:
 		
 		for product in products:
@@ -275,10 +181,13 @@ for prompt in prompts:
 
 			for size in sizes:
 				width, height = size.split('x')
-				outputUrls.append(dropbox_get_upload_link(f"{db_base_folder}output/{lang['language']}-{slugify(prompt)}-{slugify(product)}-{width}x{height}-{theTime}.jpg"))
+				outputUrls.append(dropbox_get_upload_link(dbx, f"{db_base_folder}output/{lang['language']}-{slugify(prompt)}-{slugify(product)}-{width}x{height}-{theTime}.jpg"))
+
+			renders[(lang["language"], product)] = outputRender(rbProducts[product], sizes, sizeImages, outputUrls, lang["text"])
 
-			result = createOutput(psdOnDropbox, rbProducts[product], sizes, sizeImages, outputUrls, lang["text"], ff_client_id, ff_access_token)
-			print("The Photoshop API job is being run...")
-			finalResult=pollJob(result, ff_client_id, ff_access_token)
+	print("The Photoshop API jobs are being run...")
+	for ((language, product), result) in renderPacked(psdOnDropbox, renders, ff_client_id, ffToken).items():
+		if result["status"] != 'succeeded':
+			print(f"Output for {language} and {product} {result['status']}")
 
 print("Done.")
\ No newline at end of file
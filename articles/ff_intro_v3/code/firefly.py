@@ -1,13 +1,17 @@
 import os 
-import requests 
 import json 
+import sys
+# The shared ffservices helpers live in the root of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from ffservices import client
+from ffservices.download import downloadFile
 
 #Set our creds based on environment variables.
 CLIENT_ID = os.environ.get('CLIENT_ID')
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 
 def getAccessToken(id, secret):
-	response = requests.post(f"https://ims-na1-stg1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api,ff_apis")
+	response = client.post(f"https://ims-na1-stg1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api,ff_apis")
 	return response.json()["access_token"]
 
 token = getAccessToken(CLIENT_ID, CLIENT_SECRET)
@@ -20,7 +24,7 @@ def textToImage(text, id, token):
 	}
 
 
-	response = requests.post("https://firefly-api-enterprise-stage.adobe.io/v3/images/generate", json=data, headers = {
+	response = client.post("https://firefly-api-enterprise-stage.adobe.io/v3/images/generate", json=data, headers = {
 		"X-API-Key":id, 
 		"Authorization":f"Bearer {token}",
 		"Content-Type":"application/json"
@@ -33,11 +37,6 @@ prompt = "a cat dancing on a rainbow"
 result = textToImage(prompt, CLIENT_ID, token)
 print(json.dumps(result, indent=True))
 
-def downloadFile(url, filePath):
-	with open(filePath,'wb') as output:
-		bits = requests.get(url, stream=True).content
-		output.write(bits)
-
 for output in result["outputs"]:
 	fileName = f'./{output["seed"]}.jpg'
 	downloadFile(output["image"]["url"], fileName)
@@ -1,11 +1,19 @@
 import os
-import requests 
-import dropbox
-import time 
-from dropbox.files import CommitInfo, WriteMode
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import sys
+# The shared ffservices helpers live in the root of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from ffservices import client
+from ffservices.auth import ffToken
+from ffservices.dbx import FolderLister, dropbox_connect, dropbox_get_read_link, dropbox_get_upload_link
+from ffservices.checkpoint import Checkpoint
+from ffservices.deadletter import DeadLetter
+from ffservices.photoshop import createRemoveBackgroundJob, submitJob
+from ffservices.poller import getJobStatus
 
 ff_client_id = os.environ.get('CLIENT_ID')
-ff_client_secret = os.environ.get('CLIENT_SECRET')
 db_refresh_token = os.environ.get('DROPBOX_REFRESH_TOKEN')
 db_app_key = os.environ.get('DROPBOX_APP_KEY')
 db_app_secret = os.environ.get('DROPBOX_APP_SECRET')
@@ -13,81 +21,132 @@ db_app_secret = os.environ.get('DROPBOX_APP_SECRET')
 # Base folder to use in Dropbox 
 db_base_folder = "/RemoveBGProcess/"
 
-def dropbox_connect(app_key, app_secret, refresh_token):
-	try:
-		dbx = dropbox.Dropbox(app_key=app_key, app_secret=app_secret, oauth2_refresh_token=refresh_token)
-	except AuthError as e:
-		print('Error connecting to Dropbox with access token: ' + str(e))
-	return dbx
-
-def dropbox_get_read_link(path):
-	link = dbx.sharing_create_shared_link(path).url
-	return link.replace("dl=0","dl=1")
-
-def dropbox_get_upload_link(path):
-	commit_info = CommitInfo(path=path, mode=WriteMode.overwrite)
-	return dbx.files_get_temporary_upload_link(commit_info).link
-
-def dropbox_get_input_files():
-	return dbx.files_list_folder(f'{db_base_folder}input').entries
-
-def getFFAccessToken(id, secret):
-	response = requests.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api,ff_apis")
-	return response.json()['access_token']
-
-def createRemoveBackgroundJob(input, output, id, token):
-	
-	data = {
-		"input": {
-			"href":input, 
-			"storage":"dropbox"
-		},
-		"output":{
-			"href":output, 
-			"storage":"dropbox"
-		}
-	}
-	response = requests.post(f"https://image.adobe.io/sensei/cutout", headers = {"Authorization": f"Bearer {token}", "x-api-key": id }, json=data)
-	return response.json()
-
-def pollJob(job, id, token):
-	jobUrl = job["_links"]["self"]["href"]
-	status = "" 
-	while status != 'succeeded' and status != 'failed':
-
-		response = requests.get(jobUrl, headers = {"Authorization": f"Bearer {token}", "x-api-key": id })
-		json_response = response.json()
-
-		if "status" in json_response:
-			status = json_response["status"]
-		elif "status" in json_response["outputs"][0]:
-			status = json_response["outputs"][0]["status"]
-			
-		if status != 'succeeded' and status != 'failed':
-			time.sleep(3)
-		else:
-			return json_response
-		
-# Connect to Firefly Services and Dropbox
-dbx = dropbox_connect(db_app_key, db_app_secret, db_refresh_token)
-ff_access_token = getFFAccessToken(ff_client_id, ff_client_secret)
-
-# Get a list of input files to process
-input_files = dropbox_get_input_files()
+# Where we keep track of how far through the input folder we've gotten. Run with --new-only to 
+# only process files added since the last run.
+cursor_file = os.environ.get('FF_CURSOR_FILE', os.path.join(os.path.expanduser("~"), ".cache", "ffservices", "remove_bg_cursor.txt"))
+new_only = "--new-only" in sys.argv
 
-print(f"There are {len(input_files)} file(s) to process.")
+# Run with --watch to keep running as a service, processing files as they land in the input folder
+watch = "--watch" in sys.argv
 
-for file in input_files:
+# How many files to work on at once
+concurrency = int(os.environ.get('FF_CONCURRENCY', 10))
 
-	print(f"Working on {file.name}")
-	# We need two links, a readable for input, and an writeable for output
-	read_link = dropbox_get_read_link(file.path_display)
-	write_link = dropbox_get_upload_link(f"{db_base_folder}output/{file.name}")
+# Every file we dispatch is recorded here, and again once it's done, so nothing gets processed twice
+ledger_file = os.environ.get('FF_LEDGER', os.path.join(os.path.expanduser("~"), ".cache", "ffservices", "remove_bg_ledger.db"))
 
-	# Cool, now, kick off the remove BG job
-	job = createRemoveBackgroundJob(read_link, write_link, ff_client_id, ff_access_token)
+# Files that fail are written here, so one bad file doesn't hold up the rest
+dead_letter_file = os.environ.get('FF_DEAD_LETTER', 'deadletter.jsonl')
 
-	# Poll and wait for it to finish
-	pollJob(job, ff_client_id, ff_access_token)
+# Yields files a page at a time, so we can start working before the whole folder is listed
+def dropbox_get_input_files():
+	return lister.files()
+
+# Works on one file from start to finish, this runs on the worker pool
+def process_file(key, path, name):
+	global processed
+	# Stopping, so leave anything that hasn't started yet pending in the ledger for the next start
+	with lock:
+		if stopping.is_set():
+			in_flight.discard(key)
+			return
+		running.add(key)
+	try:
+		print(f"Working on {name}")
+		# We need two links, a readable for input, and an writeable for output
+		read_link = dropbox_get_read_link(dbx, path)
+		write_link = dropbox_get_upload_link(dbx, f"{db_base_folder}output/{name}")
+
+		# Cool, now, kick off the remove BG job
+		job = createRemoveBackgroundJob(read_link, write_link, ff_client_id, ffToken())
+
+		# Wait on the shared poller for it to finish
+		result = submitJob(job, ff_client_id, ffToken).result()
+		status = getJobStatus(result)
+		ledger.put("done", key, { "name":name, "status":status })
+		if status == 'failed':
+			dead_letter.add(name, Exception(f"Job failed: {result}"), path=path)
+		print(f"Finished {name} ({status})")
+		with lock:
+			processed += 1
+	except Exception as e:
+		print(f"Error working on {name}: {e}")
+		entry = dead_letter.add(name, e, path=path)
+		# Anything worth retrying stays pending in the ledger, so it's picked up again on the next start
+		if entry["kind"] != "retryable":
+			ledger.put("done", key, { "name":name, "status":"dead-letter" })
+	finally:
+		with lock:
+			in_flight.discard(key)
+			running.discard(key)
+
+# Files are recorded by path and revision, so a file that gets replaced is processed again
+def dispatch(path, name, rev):
+	key = f"{path.lower()}:{rev}"
+	with lock:
+		if key in in_flight or ledger.has("done", key):
+			return
+		in_flight.add(key)
+	ledger.put("pending", key, { "path":path, "name":name })
+	executor.submit(process_file, key, path, name)
+
+def dispatch_files(files):
+	for file in files:
+		# Stop mid listing is fine, the cursor is only saved once a whole page is dispatched
+		if stopping.is_set():
+			break
+		dispatch(file.path_display, file.name, file.rev)
+
+# First Ctrl-C (or a SIGTERM) stops picking up new files and lets the jobs already running finish,
+# anything still queued is left for next time. A second one gives up on the running ones too.
+# Either way they're still pending in the ledger, so the next start redoes them.
+def handle_signal(signum, frame):
+	if stopping.is_set():
+		print("Quitting now.")
+		os._exit(1)
+	print(f"Stopping, waiting on {len(running)} running job(s). Press Ctrl-C again to quit now.")
+	stopping.set()
 
-print("All done.")
\ No newline at end of file
+# Connect to Firefly Services and Dropbox
+dbx = dropbox_connect(db_app_key, db_app_secret, db_refresh_token)
+ffToken()
+
+os.makedirs(os.path.dirname(cursor_file), exist_ok=True)
+lister = FolderLister(dbx, f'{db_base_folder}input', cursorFile=cursor_file, resume=new_only or watch)
+
+if client.settings["poolSize"] < concurrency:
+	client.configure(poolSize=concurrency)
+
+ledger = Checkpoint(ledger_file)
+dead_letter = DeadLetter(dead_letter_file)
+executor = ThreadPoolExecutor(max_workers=concurrency)
+lock = threading.Lock()
+in_flight = set()
+# The subset of in_flight that has actually started
+running = set()
+stopping = threading.Event()
+processed = 0
+
+signal.signal(signal.SIGINT, handle_signal)
+signal.signal(signal.SIGTERM, handle_signal)
+
+# Anything dispatched last time that never finished (ex: the process was killed) goes first
+for (key, entry) in ledger.all("pending").items():
+	if not ledger.has("done", key):
+		dispatch(entry["path"], entry["name"], key.rsplit(":", 1)[1])
+
+dispatch_files(dropbox_get_input_files())
+
+if watch:
+	print(f"Watching {db_base_folder}input for new files.")
+# Each long poll waits up to 30 seconds, so that's about how long it takes to notice a stop
+while watch and not stopping.is_set():
+	if lister.wait(timeout=30) and not stopping.is_set():
+		dispatch_files(dropbox_get_input_files())
+
+executor.shutdown(wait=True)
+ledger.close()
+
+print(f"All done, processed {processed} file(s).")
+if dead_letter.count:
+	print(f"{dead_letter.count} failure(s) written to {dead_letter.path}")
\ No newline at end of file
@@ -1,23 +1,22 @@
 import os 
-import requests 
+import sys
+# The shared ffservices helpers live in the root of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from ffservices import client
+from ffservices.download import downloadFile
 
 #Set our creds based on environment variables.
 CLIENT_ID = os.environ.get('CLIENT_ID')
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 
 def getAccessToken(id, secret):
-	response = requests.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api,ff_apis")
+	response = client.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api,ff_apis")
 	return response.json()["access_token"]
 
-def downloadFile(url, filePath):
-	with open(filePath,'wb') as output:
-		bits = requests.get(url, stream=True).content
-		output.write(bits)
-
 def uploadImage(path, id, token):
 	with open(path,'rb') as file:
 
-		response = requests.post("https://firefly-api.adobe.io/v2/storage/image", data=file, headers = {
+		response = client.post("https://firefly-api.adobe.io/v2/storage/image", data=file, headers = {
 			"X-API-Key":id, 
 			"Authorization":f"Bearer {token}",
 			"Content-Type": "image/jpeg"
@@ -37,7 +36,7 @@ def textToImageWithReference(text, reference, id, token):
 			"referenceImage": { "id":reference } 
 		}
 
-	response = requests.post("https://firefly-api.adobe.io/v2/images/generate", json=data, headers = {
+	response = client.post("https://firefly-api.adobe.io/v2/images/generate", json=data, headers = {
 		"X-API-Key":id, 
 		"Authorization":f"Bearer {token}",
 		"Content-Type":"application/json"
@@ -0,0 +1,177 @@
+# Throughput benchmark for process.py. Builds a workload of whatever size you ask for (prompts x sizes
+# x languages x products), runs the real pipeline against the mock server in ffservices/mockserver.py,
+# and reports wall time, requests per second, peak memory, and where the time went. Nothing touches
+# the real APIs, so it can be run as often as you like.
+#
+#   python benchmark.py --prompts 5 --sizes 4 --languages 3 --products 10
+#
+# Each result is appended to benchmarks.jsonl (or --results), and compared with the last run of the
+# same workload. With --max-regression, it exits with an error if wall time got worse by more than
+# that fraction, ex: --max-regression 0.1 fails on anything over 10% slower.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+# The shared ffservices helpers live in the root of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from ffservices.mockserver import MockServer, loadConfig
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+allSizes = ["1024x1024","1792x1024","1408x1024","1024x1408","2048x1024","1024x2048","1536x1024","1024x1536"]
+
+# Writes an input folder like the one process.py expects
+def buildWorkload(folder, prompts, languages, products):
+	os.makedirs(os.path.join(folder, "input", "products"))
+	with open(os.path.join(folder, "input", "prompts.txt"), "w") as file:
+		file.write("\n".join(f"Benchmark background number {x}" for x in range(prompts)))
+	with open(os.path.join(folder, "input", "translations.txt"), "w") as file:
+		file.write("\n".join(f"l{x},Buy now {x}" for x in range(languages)))
+	for x in range(products):
+		with open(os.path.join(folder, "input", "products", f"product{x}.jpg"), "wb") as file:
+			file.write(os.urandom(50 * 1024))
+	with open(os.path.join(folder, "input", "source_image.jpg"), "wb") as file:
+		file.write(os.urandom(50 * 1024))
+
+def gitRevision():
+	try:
+		return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True).stdout.strip() or None
+	except OSError:
+		return None
+
+def run(args):
+	workload = { "prompts":args.prompts, "sizes":args.sizes, "languages":args.languages, "products":args.products, "concurrency":args.concurrency, "mock":args.mock_config }
+	mockConfig = loadConfig(args.mock_config)
+	folder = tempfile.mkdtemp(prefix="ffbench-")
+
+	try:
+		buildWorkload(folder, args.prompts, args.languages, args.products)
+
+		with MockServer(mockConfig) as mock:
+			# process.py expects the template to already be in Dropbox
+			mock.putFile("/FFProcess/genfill-banner-template-text-comp.psd", b"psd")
+
+			# Every cache goes in the temp folder, so each run starts cold and nothing leaks into yours
+			env = dict(os.environ,
+				FF_BASE_URL=mock.url,
+				CLIENT_ID="benchmark", CLIENT_SECRET="benchmark",
+				DROPBOX_APP_KEY="benchmark", DROPBOX_APP_SECRET="benchmark", DROPBOX_REFRESH_TOKEN="benchmark",
+				FF_CONCURRENCY=str(args.concurrency),
+				FF_SIZES=",".join(allSizes[:args.sizes]),
+				FF_CHECKPOINT=os.path.join(folder, "checkpoint.db"),
+				FF_DEAD_LETTER=os.path.join(folder, "deadletter.jsonl"),
+				FF_REPORT=os.path.join(folder, "report.json"),
+				FF_TOKEN_CACHE=os.path.join(folder, "tokens.json"),
+				FF_POLL_STATS=os.path.join(folder, "poll_stats.json"),
+				FF_UPLOAD_CACHE=os.path.join(folder, "uploads.json"),
+				FF_DROPBOX_LINK_CACHE=os.path.join(folder, "dropbox_links.json"))
+
+			print(f"Running {args.prompts} prompt(s) x {args.sizes} size(s) x {args.languages} language(s) x {args.products} product(s)...")
+			with open(os.path.join(folder, "output.log"), "w") as log:
+				start = time.monotonic()
+				process = subprocess.Popen([sys.executable, os.path.join(here, "process.py")], cwd=folder, env=env, stdout=log, stderr=subprocess.STDOUT)
+				# wait4 gives us the resource usage of just this child
+				_, status, usage = os.wait4(process.pid, 0)
+				wallTime = time.monotonic() - start
+			process.returncode = os.waitstatus_to_exitcode(status)
+
+			stats = mock.stats()
+			outputs = sum(1 for path in mock.files if path.startswith("/ffprocess/output/"))
+
+		if process.returncode != 0:
+			with open(os.path.join(folder, "output.log"), "r") as log:
+				print(log.read()[-4000:])
+			raise SystemExit(f"process.py exited with {process.returncode}")
+
+		with open(env["FF_REPORT"], "r") as file:
+			report = json.load(file)
+	finally:
+		if not args.keep:
+			shutil.rmtree(folder, ignore_errors=True)
+		else:
+			print(f"Kept the run's files in {folder}")
+
+	requests = sum(counts["requests"] for counts in stats["endpoints"].values())
+
+	# How much of the critical path each stage accounts for
+	criticalStages = {}
+	for step in report["criticalPath"]:
+		stage = step["name"].split(":")[0]
+		criticalStages[stage] = criticalStages.get(stage, 0) + step["duration"]
+
+	return {
+		"time":time.time(),
+		"revision":gitRevision(),
+		"label":args.label,
+		"workload":workload,
+		"wallTime":wallTime,
+		"requests":requests,
+		"requestsPerSecond":requests / wallTime if wallTime else 0,
+		# ru_maxrss is in KB on Linux
+		"peakRssMB":usage.ru_maxrss / 1024,
+		"outputs":outputs,
+		"expectedOutputs":args.prompts * args.sizes * args.languages * args.products,
+		"failed":report["failed"],
+		"criticalPath":report["criticalPath"],
+		"criticalPathByStage":criticalStages,
+		"stages":report["stages"],
+		"endpoints":stats["endpoints"],
+		"maxInFlight":stats["maxInFlight"]
+	}
+
+def loadResults(path):
+	try:
+		with open(path, "r") as file:
+			return [json.loads(line) for line in file if line.strip()]
+	except OSError:
+		return []
+
+def printResult(result, baseline):
+	print(f"Wall time: {result['wallTime']:.1f}s")
+	print(f"Requests: {result['requests']} ({result['requestsPerSecond']:.1f}/s, at most {result['maxInFlight']} in flight)")
+	print(f"Peak RSS: {result['peakRssMB']:.1f} MB")
+	print(f"Outputs: {result['outputs']} of {result['expectedOutputs']}, {result['failed']} failed task(s)")
+	print("Critical path by stage:")
+	for (stage, duration) in sorted(result["criticalPathByStage"].items(), key=lambda item: -item[1]):
+		print(f"  {stage}: {duration:.1f}s")
+	print("Stages:")
+	for (stage, timing) in result["stages"].items():
+		print(f"  {stage}: {timing['tasks']} task(s), {timing['total']:.1f}s total, {timing['longest']:.1f}s longest")
+
+	if baseline:
+		print(f"Compared to {baseline.get('label') or baseline.get('revision') or 'the last run'} ({time.strftime('%Y-%m-%d %H:%M', time.localtime(baseline['time']))}):")
+		for key in ("wallTime", "requestsPerSecond", "peakRssMB"):
+			change = (result[key] - baseline[key]) / baseline[key] * 100 if baseline[key] else 0
+			print(f"  {key}: {baseline[key]:.1f} -> {result[key]:.1f} ({change:+.1f}%)")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark process.py against the mock APIs")
+	parser.add_argument("--prompts", type=int, default=3)
+	parser.add_argument("--sizes", type=int, default=4, choices=range(1, len(allSizes) + 1))
+	parser.add_argument("--languages", type=int, default=3)
+	parser.add_argument("--products", type=int, default=5)
+	parser.add_argument("--concurrency", type=int, default=int(os.environ.get('FF_CONCURRENCY', 10)))
+	parser.add_argument("--mock-config", default=os.environ.get('FF_MOCK_CONFIG'), help="JSON file of per endpoint mock settings")
+	parser.add_argument("--label", help="Name for this run in the results")
+	parser.add_argument("--results", default=os.path.join(here, "benchmarks.jsonl"))
+	parser.add_argument("--max-regression", type=float, help="Fail if wall time is worse than the last run by more than this fraction")
+	parser.add_argument("--keep", action="store_true", help="Keep the temp folder with the run's log and checkpoint")
+	args = parser.parse_args()
+
+	result = run(args)
+
+	previous = [r for r in loadResults(args.results) if r["workload"] == result["workload"]]
+	baseline = previous[-1] if previous else None
+	printResult(result, baseline)
+
+	with open(args.results, "a") as file:
+		file.write(json.dumps(result) + "\n")
+
+	if args.max_regression is not None and baseline and result["wallTime"] > baseline["wallTime"] * (1 + args.max_regression):
+		print(f"Wall time regressed more than {args.max_regression * 100:.0f}%")
+		sys.exit(1)
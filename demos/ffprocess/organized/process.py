@@ -1,12 +1,21 @@
 import os
-import requests 
-import dropbox
-from dropbox.files import CommitInfo, WriteMode
+import json
+import asyncio
 import time 
 from slugify import slugify
+import sys
+# The shared ffservices helpers live in the root of the repo
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+from ffservices import aio, uploads
+from ffservices.auth import ffToken
+from ffservices.checkpoint import Checkpoint
+from ffservices.dag import DependencyFailed, TaskGraph
+from ffservices.deadletter import DeadLetter
+from ffservices.dbx import LinkCache, UploadLinkBroker, dropbox_connect, dropbox_upload_batch
+from ffservices.poller import getJobStatus
+from ffservices.retry import FatalError
 
 ff_client_id = os.environ.get('CLIENT_ID')
-ff_client_secret = os.environ.get('CLIENT_SECRET')
 db_refresh_token = os.environ.get('DROPBOX_REFRESH_TOKEN')
 db_app_key = os.environ.get('DROPBOX_APP_KEY')
 db_app_secret = os.environ.get('DROPBOX_APP_SECRET')
@@ -14,8 +23,24 @@ db_app_secret = os.environ.get('DROPBOX_APP_SECRET')
 # Base folder to use in Dropbox 
 db_base_folder = "/FFProcess/"
 
-# The output sizes
-sizes = ["1024x1024","1792x1024","1408x1024","1024x1408"]
+# The output sizes. The first one is the size we generate at, the rest are expanded from it.
+sizes = os.environ.get('FF_SIZES', "1024x1024,1792x1024,1408x1024,1024x1408").split(",")
+
+# How many API calls/jobs we allow in flight at once
+concurrency = int(os.environ.get('FF_CONCURRENCY', 10))
+
+# Finished work is recorded here, so a rerun after a crash picks up where it left off. 
+# Delete the file to start from scratch.
+checkpoint = Checkpoint(os.environ.get('FF_CHECKPOINT', 'checkpoint.db'))
+
+# Anything that fails is written here and the rest of the run carries on
+deadLetter = DeadLetter(os.environ.get('FF_DEAD_LETTER', 'deadletter.jsonl'))
+
+# Firefly result URLs are presigned and only good for a limited time, so don't reuse old ones
+urlMaxAge = 60 * 50
+
+# The style reference for every generated background
+referencePath = 'input/source_image.jpg'
 
 # Prompts
 prompts = [line.rstrip() for line in open('input/prompts.txt','r')]
@@ -30,247 +55,164 @@ for l in langs:
 # Products sources from a set of images.
 products = os.listdir("input/products")
 
-def createRemoveBackgroundJob(input, output, id, token):
-	
-	data = {
-		"input": {
-			"href":input, 
-			"storage":"dropbox"
-		},
-		"output":{
-			"href":output, 
-			"storage":"dropbox"
-		}
-	}
-	response = requests.post(f"https://image.adobe.io/sensei/cutout", headers = {"Authorization": f"Bearer {token}", "x-api-key": id }, json=data)
-	return response.json()
-
-def pollJob(job, id, token):
-	jobUrl = job["_links"]["self"]["href"]
-	status = "" 
-	while status != 'succeeded' and status != 'failed':
-
-		response = requests.get(jobUrl, headers = {"Authorization": f"Bearer {token}", "x-api-key": id })
-		json_response = response.json()
-
-		if "status" in json_response:
-			status = json_response["status"]
-		elif "status" in json_response["outputs"][0]:
-			status = json_response["outputs"][0]["status"]
-			
-		if status != 'succeeded' and status != 'failed':
-			time.sleep(3)
-		else:
-			return json_response
-
-def dropbox_connect(app_key, app_secret, refresh_token):
-	try:
-		dbx = dropbox.Dropbox(app_key=app_key, app_secret=app_secret, oauth2_refresh_token=refresh_token)
-	except AuthError as e:
-		print('Error connecting to Dropbox with access token: ' + str(e))
-	return dbx
-
-def dropbox_upload(f, folder):
-		newName = folder + '/' + f.split('/')[-1]
-		with open(f,'rb') as file:
-			dbx.files_upload(file.read(), newName)
-
-def dropbox_get_read_link(path):
-	link = dbx.sharing_create_shared_link(path).url
-	return link.replace("dl=0","dl=1")
-
-def dropbox_get_upload_link(path):
-	commit_info = CommitInfo(path=path, mode=WriteMode.overwrite)
-	return dbx.files_get_temporary_upload_link(commit_info).link
-
-
-def getFFAccessToken(id, secret):
-	response = requests.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api,ff_apis")
-	return response.json()['access_token']
-
-def createOutput(psd, koProduct, sizes, sizeUrls, outputs, text, id, token):
-
-	data = {
-		"inputs": [{
-			"href":psd, 
-			"storage":"dropbox"
-		}],
-		"options":{
-			"layers":[
-			]
-		},
-		"outputs":[]
-	}
-
-	for (x,size) in enumerate(sizes):
-		width, height = size.split('x')
-		url = sizeUrls[size]
-		data["options"]["layers"].append({
-			"name":f"{width}x{height}-text",
-			"edit":{},
-			"text":{
-				"content":text
-			}
-		})
-
-		data["options"]["layers"].append({
-			"name":f"{width}x{height}-background",
-			"edit":{},
-			"input":{
-				"storage":"external", 
-				"href":url
-			}
-		})
-
-		data["options"]["layers"].append({
-			"name":f"{width}x{height}-product",
-			"edit":{},
-			"input":{
-				"storage":"external", 
-				"href":koProduct
-			}
-		})
-
-		data["outputs"].append({
-			"href":outputs[x], 
-			"storage":"dropbox",
-			"type":"image/jpeg",
-			"trimToCanvas":True,
-			"layers":[{
-				"name":f"{width}x{height}"
-			}]
-	
-		})
-
-	response = requests.post(f"https://image.adobe.io/pie/psdService/documentOperations", headers = {"Authorization": f"Bearer {token}", "x-api-key": id }, json=data)
-	return response.json()
-
-def uploadImage(path, id, token):
-	
-	with open(path,'rb') as file:
-
-		response = requests.post("https://firefly-api.adobe.io/v2/storage/image", data=file, headers = {
-			"X-API-Key":id, 
-			"Authorization":f"Bearer {token}",
-			"Content-Type": "image/jpeg"
-		}) 
-
-		# Simplify the return a bit... 
-		return response.json()["images"][0]["id"]
-
-
-def textToImage(text, imageId, id, token):
-
-	data = {
-		"n":1,
-		"prompt":text,
-		"contentClass":"photo",
-		"size":{
-			"width":2048,
-			"height":2048
-		},
-		"styles":{
-			"referenceImage":{
-				"id":imageId
-			}
-		}
-	}
-
-	response = requests.post("https://firefly-api.adobe.io/v2/images/generate", json=data, headers = {
-		"X-API-Key":id, 
-		"Authorization":f"Bearer {token}",
-		"Content-Type":"application/json"
-	}) 
-
-	return response.json()["outputs"][0]["image"]["id"]
-
-def generativeExpand(imageId, size, id, token):
+# A failed job still comes back from polling like any other, so turn it into an error. That way the
+# graph skips whatever depended on it and it ends up in the dead letter file.
+def checkJob(result, what):
+	status = getJobStatus(result)
+	if status != 'succeeded':
+		raise FatalError(f"{what} job {status}: {json.dumps(result)[:500]}", "fatal", body=result)
+	return result
+
+async def removeBackground(product):
 
+	# Already done in an earlier run?
+	if checkpoint.has("knockout", product):
+		return checkpoint.get("knockout", product)
+
+	# The source was uploaded with the rest of the products, get a readable link for it
+	readableLink = await asyncio.to_thread(links.get, f"{db_base_folder}input/{product}")
+
+	# Make a link to upload the result 
+	writableLink = await asyncio.to_thread(uploadLinks.get, f"{db_base_folder}knockout/{product}")
+
+	rbJob = await aio.createRemoveBackgroundJob(readableLink, writableLink, ff_client_id, ffToken())
+	checkJob(await aio.pollJob(rbJob, ff_client_id, ffToken), f"Remove background for {product}")
+
+	# The job just wrote a new version of this file
+	links.invalidate(f"{db_base_folder}knockout/{product}")
+	koProduct = await asyncio.to_thread(links.get, f"{db_base_folder}knockout/{product}")
+	checkpoint.put("knockout", product, koProduct)
+	return koProduct
+
+async def generateBackground(prompt, referenceImage):
+	found = checkpoint.get("generate", prompt, maxAge=urlMaxAge)
+	if found is not None:
+		return found
+
+	# For each prompt, generate a new background using prompt and reference. The URL expires but the
+	# seed doesn't, so if this prompt was generated in an earlier run, the same seed makes the same
+	# background again and the outputs still to do match the ones already done.
+	seed = checkpoint.get("seed", prompt)
+	print(f"Generating an image with prompt: {prompt}.")
+	try:
+		output = await aio.textToImageOutput(prompt, referenceImage, ff_client_id, ffToken(), sizes[0], seed)
+	except FatalError as e:
+		if not uploads.isStale(e):
+			raise
+		# Firefly dropped the reference upload before we expected, so upload it again and try once more
+		uploads.forget(referencePath, ff_client_id, referenceImage)
+		referenceImage = await aio.uploadImage(referencePath, ff_client_id, ffToken())
+		output = await aio.textToImageOutput(prompt, referenceImage, ff_client_id, ffToken(), sizes[0], seed)
+	checkpoint.put("seed", prompt, output["seed"])
+	return checkpoint.put("generate", prompt, output["image"]["url"])
+
+async def expandBackgrounds(newImage):
+	# The first size is the original, the rest are expanded from it all at once. These are keyed by the
+	# generated image, so if that had to be redone the expansions get redone too.
+	found = { size:checkpoint.get("expand", f"{newImage}|{size}", maxAge=urlMaxAge) for size in sizes[1:] }
+	missing = [size for size in sizes[1:] if found[size] is None]
+	if missing:
+		print(f"Generating expanded ones at sizes {', '.join(missing)}")
+		for (size, url) in (await aio.expandSizes(newImage, missing, ff_client_id, ffToken())).items():
+			found[size] = checkpoint.put("expand", f"{newImage}|{size}", url)
+	return { sizes[0]:newImage, **found }
+
+def outputKey(prompt, lang, product):
+	return f"{lang['language']}|{prompt}|{product}"
+
+def outputPath(prompt, lang, product, size):
 	width, height = size.split('x')
+	return f"{db_base_folder}output/{lang['language']}-{slugify(prompt)}-{slugify(product)}-{width}x{height}-{theTime}.jpg"
 
-	data = {
-		"n":1,
-		"image":{
-			"id":imageId
-		},
-		"size":{
-			"width":width, 
-			"height":height
-		}
-	}
+async def renderOutput(prompt, lang, product, psdOnDropbox, koProduct, sizeImages):
 
-	response = requests.post("https://firefly-api.adobe.io/v1/images/expand", json=data, headers = {
-		"X-API-Key":id, 
-		"Authorization":f"Bearer {token}",
-		"Content-Type":"application/json"
-	}) 
+	print(f'Working with language {lang["language"]} and {product}')
 
-	return response.json()["images"][0]["image"]["presignedUrl"]
+	# These were minted ahead of time by the broker, so this normally doesn't wait on Dropbox
+	outputPaths = [outputPath(prompt, lang, product, size) for size in sizes]
+	outputUrls = [await asyncio.to_thread(uploadLinks.get, path) for path in outputPaths]
 
+	result = await aio.createOutput(psdOnDropbox, koProduct, sizes, sizeImages, outputUrls, lang["text"], ff_client_id, ffToken())
+	print("The Photoshop API job is being run...")
+	checkJob(await aio.pollJob(result, ff_client_id, ffToken), f"Output for {lang['language']} and {product}")
+	checkpoint.put("output", outputKey(prompt, lang, product), outputPaths)
 
-# Connect to Firefly Services and Dropbox
-dbx = dropbox_connect(db_app_key, db_app_secret, db_refresh_token)
-ff_access_token = getFFAccessToken(ff_client_id, ff_client_secret)
-print("Connected to Firefly and Dropbox APIs.")
+# Every call is a task in a dependency graph. Each output starts as soon as its own knockout product
+# and expanded backgrounds exist, instead of waiting for whole stages to finish.
+def buildGraph(pipeline):
 
-referenceImage = uploadImage('input/source_image.jpg', ff_client_id, ff_access_token)
-print("Reference image uploaded.")
+	graph = TaskGraph(pipeline)
 
-# We use this to remember where are product images w/ the backgrounds are stored.
-rbProducts = {}
-for product in products:
-	
-	# First, upload the source
-	dropbox_upload(f"input/products/{product}", f"{db_base_folder}input")
+	graph.add("reference", lambda: aio.uploadImage(referencePath, ff_client_id, ffToken()))
 
-	# Get a readable link for that
-	readableLink = dropbox_get_read_link(f"{db_base_folder}input/{product}")
+	# I'm using this later when generating final results.
+	graph.add("psd", lambda: asyncio.to_thread(links.get, f"{db_base_folder}genfill-banner-template-text-comp.psd"))
 
-	# Make a link to upload the result 
-	writableLink = dropbox_get_upload_link(f"{db_base_folder}knockout/{product}")
+	# Upload every product that still needs its background removed in one batch
+	pending = [product for product in products if not checkpoint.has("knockout", product)]
+	uploadLinks.prefetch([f"{db_base_folder}knockout/{product}" for product in pending])
+	graph.add("upload-products", lambda: asyncio.to_thread(dropbox_upload_batch, dbx, [f"input/products/{product}" for product in pending], f"{db_base_folder}input"))
 
-	rbJob = createRemoveBackgroundJob(readableLink, writableLink, ff_client_id, ff_access_token)
-	result = pollJob(rbJob, ff_client_id, ff_access_token)
+	for product in products:
+		graph.add(f"knockout:{product}", lambda uploaded, product=product: removeBackground(product), ["upload-products"])
 
-	readableLink = dropbox_get_read_link(f"{db_base_folder}knockout/{product}")
-	rbProducts[product] = readableLink
-	# For now, we assume ok
+	for prompt in prompts:
 
+		# Only outputs that weren't finished in an earlier run
+		remaining = [(lang, product) for lang in languages for product in products if not checkpoint.has("output", outputKey(prompt, lang, product))]
+		if not remaining:
+			print(f"Skipping prompt, already complete: {prompt}.")
+			continue
 
-theTime = time.time()
-for prompt in prompts:
-	
-	# For each prompt, generate a new background using prompt and reference
-	print(f"Generating an image with prompt: {prompt}.")
-	newImage = textToImage(prompt, referenceImage, ff_client_id, ff_access_token)
+		generated = graph.add(f"generate:{prompt}", lambda referenceImage, prompt=prompt: generateBackground(prompt, referenceImage), ["reference"])
 
-	# I store a key from size to the image
-	sizeImages = {}
+		expanded = graph.add(f"expand:{prompt}", expandBackgrounds, [generated])
 
-	for size in sizes:
-		# For each size, generate an expanded background
-		print(f"Generating an expanded one at size {size}")
-		expandedBackground = generativeExpand(newImage, size, ff_client_id, ff_access_token)
-		sizeImages[size] = expandedBackground
+		# Start minting the upload links for every output now, rather than one at a time as we need them
+		uploadLinks.prefetch([outputPath(prompt, lang, product, size) for (lang, product) in remaining for size in sizes])
 
+		for (lang, product) in remaining:
+			graph.add(f"output:{lang['language']}:{prompt}:{product}",
+				lambda psd, koProduct, sizeImages, prompt=prompt, lang=lang, product=product: renderOutput(prompt, lang, product, psd, koProduct, sizeImages),
+				["psd", f"knockout:{product}", expanded])
 
-	# I'm using this later when generating final results.
-	psdOnDropbox = dropbox_get_read_link(f"{db_base_folder}genfill-banner-template-text-comp.psd")
+	return graph
+
+async def main():
 
-	for lang in languages:
-		
-		for product in products:
-			
-			print(f'Working with language {lang["language"]} and {product}')
+	graph = buildGraph(aio.Pipeline(concurrency))
+	await graph.run()
 
-			outputUrls = []
+	# Tasks skipped because of an earlier failure don't need their own entry
+	for name, error in graph.errors.items():
+		print(f"Failed: {name} ({error})")
+		if not isinstance(error, DependencyFailed):
+			# Failed jobs carry their whole status response, which is the useful part
+			deadLetter.add(name, error, **({ "job":error.body } if isinstance(error, FatalError) and isinstance(error.body, dict) else {}))
+	if deadLetter.count:
+		print(f"{deadLetter.count} failure(s) written to {deadLetter.path}")
 
-			for size in sizes:
-				width, height = size.split('x')
-				outputUrls.append(dropbox_get_upload_link(f"{db_base_folder}output/{lang['language']}-{slugify(prompt)}-{slugify(product)}-{width}x{height}-{theTime}.jpg"))
+	print("Critical path:")
+	for step in graph.criticalPath():
+		print(f"  {step['name']}: {step['duration']:.1f}s")
+
+	# benchmark.py reads this back
+	if os.environ.get('FF_REPORT'):
+		with open(os.environ['FF_REPORT'], "w") as file:
+			json.dump({ "criticalPath":graph.criticalPath(), "stages":graph.stages(), "failed":len(graph.errors) }, file)
+
+# Connect to Firefly Services and Dropbox
+dbx = dropbox_connect(db_app_key, db_app_secret, db_refresh_token)
+
+# Readable links are cached, so grab all the ones that already exist in one go
+links = LinkCache(dbx)
+links.prefetch()
+uploadLinks = UploadLinkBroker(dbx)
+ffToken()
+print("Connected to Firefly and Dropbox APIs.")
 
-			result = createOutput(psdOnDropbox, rbProducts[product], sizes, sizeImages, outputUrls, lang["text"], ff_client_id, ff_access_token)
-			print("The Photoshop API job is being run...")
-			finalResult=pollJob(result, ff_client_id, ff_access_token)
+# Reuse the original run's timestamp when resuming, so output names stay consistent
+theTime = checkpoint.once("run", "time", time.time)
+aio.run(main(), concurrency)
 
-print("Done.")
\ No newline at end of file
+print("Done.")
@@ -0,0 +1,2 @@
+# Shared helpers used by the Python scripts in this repo (Firefly, Photoshop, and Dropbox).
+# Scripts outside the repo root add the root to sys.path before importing from here.
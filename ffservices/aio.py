@@ -0,0 +1,64 @@
+# Asyncio versions of the Firefly and Photoshop helpers, plus a small pipeline driver that caps how
+# many calls are in flight at once. The HTTP calls themselves run on worker threads against the
+# shared pooled session in client.py, so sync and async code use the same connections (and the same
+# token cache).
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from ffservices import client, firefly, photoshop, poller, uploads
+
+# Skips the upload if this exact file was already uploaded recently
+async def uploadImage(path, id, token):
+	return await asyncio.to_thread(uploads.uploadImage, path, id, token)
+
+async def textToImage(text, imageId, id, token, size="1024x1024"):
+	return await asyncio.to_thread(firefly.textToImage, text, imageId, id, token, size)
+
+async def textToImageOutput(text, imageId, id, token, size="1024x1024", seed=None):
+	return await asyncio.to_thread(firefly.textToImageOutput, text, imageId, id, token, size, seed)
+
+async def generativeExpand(imageUrl, size, id, token):
+	return await asyncio.to_thread(firefly.generativeExpand, imageUrl, size, id, token)
+
+# Every size goes out at once, and repeats of an (image, size) already asked for are shared
+async def expandSizes(imageUrl, sizes, id, token, sourceSize=None):
+	futures = firefly.getExpander().submit(imageUrl, sizes, id, token, sourceSize)
+	urls = await asyncio.gather(*[asyncio.wrap_future(future) for future in futures.values()])
+	return dict(zip(futures.keys(), urls))
+
+async def createRemoveBackgroundJob(input, output, id, token):
+	return await asyncio.to_thread(photoshop.createRemoveBackgroundJob, input, output, id, token)
+
+async def createOutput(psd, koProduct, sizes, sizeUrls, outputs, text, id, token):
+	return await asyncio.to_thread(photoshop.createOutput, psd, koProduct, sizes, sizeUrls, outputs, text, id, token)
+
+# Waits on the shared poller, so no thread is tied up while the job runs
+async def pollJob(job, id, token, kind=None):
+	return await asyncio.wrap_future(poller.submitJob(job, id, token, kind))
+
+class Pipeline:
+
+	def __init__(self, limit=10):
+		self.limit = limit
+		self.semaphore = asyncio.Semaphore(limit)
+
+	# Runs fn(*args) once there's a free slot. Don't nest calls, a unit that holds a slot
+	# and waits on another slot can deadlock once the pipeline is full.
+	async def call(self, fn, *args, **kwargs):
+		async with self.semaphore:
+			return await fn(*args, **kwargs)
+
+	async def map(self, fn, items):
+		return await asyncio.gather(*[self.call(fn, item) for item in items])
+
+def run(main, limit=10):
+
+	# Make sure there are enough threads and pooled connections for everything that can be in flight
+	if client.settings["poolSize"] < limit:
+		client.configure(poolSize=limit)
+
+	async def runner():
+		asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=limit + 4))
+		return await main
+
+	return asyncio.run(runner())
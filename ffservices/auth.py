@@ -0,0 +1,160 @@
+# Access token cache for IMS. Every script used to hit /ims/token/v3 on startup and then hang on
+# to that one token forever, which meant long pipelines died when it expired and short CLI runs
+# paid for an IMS round trip every single time.
+#
+# Tokens are cached in memory and on disk, keyed by client id and scope, and get refreshed in the
+# background before expires_in runs out. All callers in a process share one provider per key, so
+# a pool of workers asking for a token at the same time only results in one call to IMS.
+
+import os
+import json
+import time
+import threading
+from ffservices import client
+from ffservices.retry import raiseForStatus
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+IMS_URL = "https://ims-na1.adobelogin.com/ims/token/v3"
+
+FF_SCOPE = "openid,AdobeID,firefly_enterprise,firefly_api,ff_apis"
+PS_SCOPE = "openid,AdobeID"
+
+cacheFile = os.environ.get('FF_TOKEN_CACHE', os.path.join(os.path.expanduser("~"), ".cache", "ffservices", "tokens.json"))
+
+# Refresh when there's less than this many seconds left on a token
+refreshMargin = 300
+# If a background refresh fails, try again this soon (as long as the current token is still good)
+retryDelay = 30
+
+class TokenProvider:
+
+	def __init__(self, id, secret, scope=FF_SCOPE, cachePath=None, background=True):
+		self.id = id
+		self.secret = secret
+		self.scope = scope
+		self.key = f"{id}:{scope}"
+		self.cachePath = cachePath or cacheFile
+		self.background = background
+		self.token = None
+		self.expiresAt = 0
+		self._lock = threading.Lock()
+		self._timer = None
+
+	def isFresh(self, expiresAt):
+		return expiresAt - refreshMargin > time.time()
+
+	def getToken(self):
+		# Fast path, no locking needed
+		if self.token and self.isFresh(self.expiresAt):
+			return self.token
+
+		with self._lock:
+			# Someone else may have refreshed while we were waiting on the lock
+			if self.token and self.isFresh(self.expiresAt):
+				return self.token
+			self._refresh()
+			return self.token
+
+	def invalidate(self):
+		with self._lock:
+			self.token = None
+			self.expiresAt = 0
+
+	def _refresh(self, force=False):
+		with _FileLock(self.cachePath):
+			# Another process may have already done the work. When forced (a background refresh)
+			# we only take the cached token if it's newer than the one we have.
+			cached = _readCache(self.cachePath).get(self.key)
+			if cached and self.isFresh(cached["expiresAt"]) and (not force or cached["expiresAt"] > self.expiresAt):
+				self.token, self.expiresAt = cached["token"], cached["expiresAt"]
+			else:
+				# Sent as a form body, so the secret never ends up in a URL (and from there in an error message)
+				response = client.post(IMS_URL, data={ "client_id":self.id, "client_secret":self.secret, "grant_type":"client_credentials", "scope":self.scope }, idempotent=True)
+				# So a 5xx from IMS counts as retryable, not as something wrong with the request
+				raiseForStatus(response)
+				result = response.json()
+				self.token = result["access_token"]
+				self.expiresAt = time.time() + int(result["expires_in"])
+				_writeCache(self.cachePath, self.key, { "token":self.token, "expiresAt":self.expiresAt })
+		# Refresh ahead of time so callers never have to wait on IMS
+		lifetime = self.expiresAt - time.time()
+		self._schedule(lifetime - min(2 * refreshMargin, lifetime / 2))
+
+	def _backgroundRefresh(self):
+		try:
+			with self._lock:
+				self._refresh(force=True)
+		except Exception as e:
+			print(f"Background token refresh failed, will retry: {e}")
+			if self.expiresAt > time.time():
+				self._schedule(retryDelay)
+
+	def _schedule(self, delay):
+		if not self.background:
+			return
+		if self._timer is not None:
+			self._timer.cancel()
+		self._timer = threading.Timer(max(delay, 1), self._backgroundRefresh)
+		self._timer.daemon = True
+		self._timer.start()
+
+_providers = {}
+_providersLock = threading.Lock()
+
+def getProvider(id, secret, scope=FF_SCOPE):
+	with _providersLock:
+		key = (id, scope)
+		if key not in _providers:
+			_providers[key] = TokenProvider(id, secret, scope)
+		return _providers[key]
+
+def getFFAccessToken(id, secret):
+	return getProvider(id, secret, FF_SCOPE).getToken()
+
+def getPhotoshopAccessToken(id, secret):
+	return getProvider(id, secret, PS_SCOPE).getToken()
+
+# For the pipeline scripts, which all take their credentials from CLIENT_ID and CLIENT_SECRET. Tokens
+# are cached and refreshed in the background, so it's fine to ask for one on every call.
+def ffToken():
+	return getFFAccessToken(os.environ.get('CLIENT_ID'), os.environ.get('CLIENT_SECRET'))
+
+def _readCache(path):
+	try:
+		with open(path, "r") as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return {}
+
+def _writeCache(path, key, entry):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	cache = _readCache(path)
+	cache[key] = entry
+	# Drop anything that's already expired while we're here
+	cache = { k:v for k,v in cache.items() if v["expiresAt"] > time.time() }
+	temp = f"{path}.{os.getpid()}.tmp"
+	with open(os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as file:
+		json.dump(cache, file)
+	os.replace(temp, path)
+
+class _FileLock:
+
+	def __init__(self, path):
+		self.path = f"{path}.lock"
+		self.file = None
+
+	def __enter__(self):
+		if fcntl is not None:
+			os.makedirs(os.path.dirname(self.path), exist_ok=True)
+			self.file = open(self.path, "w")
+			fcntl.flock(self.file, fcntl.LOCK_EX)
+		return self
+
+	def __exit__(self, *args):
+		if self.file is not None:
+			fcntl.flock(self.file, fcntl.LOCK_UN)
+			self.file.close()
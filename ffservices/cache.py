@@ -0,0 +1,125 @@
+# Local cache for generated assets. Each entry is keyed by a hash of the request JSON (with keys
+# sorted, so field order doesn't matter) plus the hashes of any input images, and holds the API
+# response along with the downloaded image bytes. Running the same request again reads from disk
+# instead of paying for another generation.
+#
+# Generations without explicit seeds are random, so by default those aren't cached. Turning on
+# reuseSeeds makes them cacheable too, which means a repeat run gets back the images (and seeds)
+# from the first one. Least recently used entries are evicted once the cache grows past maxBytes.
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from ffservices.download import downloadFiles, hashFile
+
+cacheDir = os.environ.get('FF_ASSET_CACHE', os.path.join(os.path.expanduser("~"), ".cache", "ffservices", "assets"))
+cacheMaxBytes = int(os.environ.get('FF_ASSET_CACHE_MB', 2048)) * 1024 * 1024
+
+def requestKey(endpoint, data, inputFiles=()):
+	canonical = json.dumps({ "endpoint":endpoint, "data":data, "inputs":[hashFile(f) for f in inputFiles] }, sort_keys=True, separators=(",",":"))
+	return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def hasSeeds(data):
+	return bool(data.get("seeds"))
+
+# Older endpoints return presignedUrl, v3 returns url
+def imageUrl(output):
+	return output["image"].get("presignedUrl") or output["image"].get("url")
+
+class AssetCache:
+
+	def __init__(self, path=None, maxBytes=None, reuseSeeds=False):
+		self.path = path or cacheDir
+		self.maxBytes = maxBytes or cacheMaxBytes
+		self.reuseSeeds = reuseSeeds
+		self._lock = threading.Lock()
+
+	def cacheable(self, data):
+		return self.reuseSeeds or hasSeeds(data)
+
+	def entryDir(self, key):
+		return os.path.join(self.path, key[:2], key)
+
+	# Returns (response, [image paths]) or None. Reading an entry marks it as recently used.
+	def get(self, key):
+		entry = self.entryDir(key)
+		try:
+			with open(os.path.join(entry, "response.json"), "r") as file:
+				meta = json.load(file)
+		except (OSError, ValueError):
+			return None
+		images = [os.path.join(entry, name) for name in meta["images"]]
+		if not all(os.path.exists(image) for image in images):
+			return None
+		os.utime(os.path.join(entry, "response.json"))
+		return meta["response"], images
+
+	# images is a list of local files to copy into the cache entry
+	def put(self, key, response, images):
+		entry = self.entryDir(key)
+		temp = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+		os.makedirs(temp, exist_ok=True)
+		names = []
+		for (x, image) in enumerate(images):
+			names.append(f"{x}{os.path.splitext(image)[1] or '.jpg'}")
+			shutil.copyfile(image, os.path.join(temp, names[-1]))
+		with open(os.path.join(temp, "response.json"), "w") as file:
+			json.dump({ "response":response, "images":names }, file)
+		with self._lock:
+			shutil.rmtree(entry, ignore_errors=True)
+			os.replace(temp, entry)
+		self.evict()
+		return response, [os.path.join(entry, name) for name in names]
+
+	def evict(self):
+		with self._lock:
+			entries = []
+			total = 0
+			for prefix in os.listdir(self.path) if os.path.isdir(self.path) else []:
+				for key in os.listdir(os.path.join(self.path, prefix)):
+					entry = os.path.join(self.path, prefix, key)
+					marker = os.path.join(entry, "response.json")
+					if key.endswith(".tmp") or not os.path.exists(marker):
+						continue
+					size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+					entries.append((os.path.getmtime(marker), size, entry))
+					total += size
+
+			# Oldest first
+			for (used, size, entry) in sorted(entries):
+				if total <= self.maxBytes:
+					break
+				shutil.rmtree(entry, ignore_errors=True)
+				total -= size
+
+	# Returns (response, saved paths) if this request is cached, copying the images to nameFor(output)
+	def restore(self, endpoint, data, nameFor, inputFiles=()):
+		cached = self.get(requestKey(endpoint, data, inputFiles)) if self.cacheable(data) else None
+		if cached is None:
+			return None
+		response, images = cached
+		saved = []
+		for (output, image) in zip(response["outputs"], images):
+			saved.append(nameFor(output))
+			shutil.copyfile(image, saved[-1])
+		return response, saved
+
+	# Records a response and its downloaded images, if the request is cacheable
+	def save(self, endpoint, data, response, saved, inputFiles=()):
+		if self.cacheable(data):
+			self.put(requestKey(endpoint, data, inputFiles), response, saved)
+
+	# Runs call() (which should make the API request and return its JSON) unless there's already a
+	# cached result for this request, then saves each output to nameFor(output). Returns the
+	# response and the saved paths, along with whether it came from the cache.
+	def fetch(self, endpoint, data, call, nameFor, inputFiles=()):
+		restored = self.restore(endpoint, data, nameFor, inputFiles)
+		if restored is not None:
+			return restored[0], restored[1], True
+
+		response = call()
+		saved = downloadFiles([(imageUrl(output), nameFor(output)) for output in response["outputs"]])
+		self.save(endpoint, data, response, saved, inputFiles)
+		return response, saved, False
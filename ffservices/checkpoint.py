@@ -0,0 +1,63 @@
+# Checkpoint store for long running pipelines. Each finished unit of work gets recorded in a small
+# SQLite database (stage + key -> JSON value), so if a run dies part way through, running it again
+# skips everything that already finished and only makes the calls that are still missing.
+
+import json
+import time
+import sqlite3
+import threading
+
+class Checkpoint:
+
+	def __init__(self, path):
+		self.path = path
+		self._lock = threading.Lock()
+		self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("CREATE TABLE IF NOT EXISTS results (stage TEXT, key TEXT, value TEXT, created REAL, PRIMARY KEY (stage, key))")
+
+	# maxAge (in seconds) is for results that go stale, like presigned URLs
+	def get(self, stage, key, default=None, maxAge=None):
+		with self._lock:
+			row = self.db.execute("SELECT value, created FROM results WHERE stage = ? AND key = ?", (stage, key)).fetchone()
+		if row is None or (maxAge is not None and time.time() - row[1] > maxAge):
+			return default
+		return json.loads(row[0])
+
+	def has(self, stage, key, maxAge=None):
+		return self.get(stage, key, maxAge=maxAge) is not None
+
+	def put(self, stage, key, value):
+		with self._lock:
+			self.db.execute("INSERT OR REPLACE INTO results (stage, key, value, created) VALUES (?, ?, ?, ?)", (stage, key, json.dumps(value), time.time()))
+		return value
+
+	def all(self, stage):
+		with self._lock:
+			rows = self.db.execute("SELECT key, value FROM results WHERE stage = ?", (stage,)).fetchall()
+		return { key:json.loads(value) for key,value in rows }
+
+	def clear(self, stage=None):
+		with self._lock:
+			if stage is None:
+				self.db.execute("DELETE FROM results")
+			else:
+				self.db.execute("DELETE FROM results WHERE stage = ?", (stage,))
+
+	# Returns the recorded result for stage/key, or runs fn() and records what it returns
+	def once(self, stage, key, fn, maxAge=None):
+		value = self.get(stage, key, maxAge=maxAge)
+		if value is None:
+			value = self.put(stage, key, fn())
+		return value
+
+	# Same as once(), but for async pipelines
+	async def onceAsync(self, stage, key, fn, maxAge=None):
+		value = self.get(stage, key, maxAge=maxAge)
+		if value is None:
+			value = self.put(stage, key, await fn())
+		return value
+
+	def close(self):
+		with self._lock:
+			self.db.close()
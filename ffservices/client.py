@@ -0,0 +1,173 @@
+# Shared HTTP client for the Firefly, Photoshop, and Dropbox scripts. Instead of calling 
+# requests.post/get directly (which does a fresh TCP+TLS handshake every time), everything 
+# goes through one keep-alive Session. requests keeps a connection pool for each host, so 
+# firefly-api.adobe.io, image.adobe.io, and the presigned S3 hosts all get their connections reused.
+
+import os
+import time
+import threading
+import contextlib
+import contextvars
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from ffservices import ratelimit, retry, trace
+
+# Defaults can be changed via environment variables or by calling configure() before the first request.
+settings = {
+	# How many different hosts we keep pools around for
+	"poolConnections": int(os.environ.get('FF_POOL_CONNECTIONS', 10)),
+	# How many connections we keep open to any one host
+	"poolSize": int(os.environ.get('FF_POOL_SIZE', 20)),
+	# Optional per host overrides, ex: {"image.adobe.io": 50}
+	"hostPoolSizes": {},
+	"connectTimeout": float(os.environ.get('FF_CONNECT_TIMEOUT', 10)),
+	"readTimeout": float(os.environ.get('FF_READ_TIMEOUT', 120)),
+	# Sends requests for any host ending in one of these domains somewhere else instead, ex: 
+	# {"adobe.io": "http://localhost:8900"}. FF_BASE_URL points every API (IMS, Firefly, Photoshop, 
+	# and Dropbox) at one place, like the mock server in mockserver.py.
+	"baseUrls": {}
+}
+
+apiDomains = ["adobelogin.com", "adobe.io", "dropboxapi.com"]
+if os.environ.get('FF_BASE_URL'):
+	settings["baseUrls"] = { domain:os.environ['FF_BASE_URL'] for domain in apiDomains }
+
+def resolve(url):
+	parsed = urlparse(url)
+	host = parsed.hostname or ""
+	for (domain, base) in settings["baseUrls"].items():
+		if host == domain or host.endswith("." + domain):
+			return base.rstrip("/") + url[len(f"{parsed.scheme}://{parsed.netloc}"):]
+	return url
+
+# Set while request() below is working through its retries. It checks the breaker and records the
+# outcome once for the whole request, so one request's retries can't trip its own host's breaker.
+_retrying = contextvars.ContextVar("retrying", default=False)
+
+# Every request made through the session waits its turn with the endpoint's rate limiter and checks
+# the host's circuit breaker, including the ones the Dropbox SDK makes when it's handed this session.
+# Limits are worked out from the real URL, before it's pointed at a different base URL.
+class LimitedSession(requests.Session):
+
+	def request(self, method, url, *args, **kwargs):
+		with _span(method, url) as traced:
+			breaker = None if _retrying.get() else retry.getBreaker(url)
+			if breaker:
+				breaker.allow()
+			queued = time.monotonic()
+			with ratelimit.limit(url) as limiter:
+				traced.add("queued", time.monotonic() - queued)
+				try:
+					response = super().request(method, resolve(url), *args, **kwargs)
+				except requests.RequestException as e:
+					if breaker:
+						breaker.record(retry.classify(error=e) != "retryable")
+					raise
+				limiter.update(response)
+				# 429s are the rate limiter's problem, they don't mean the host is down
+				if breaker:
+					breaker.record(response.status_code < 500)
+				traced.set("status", response.status_code)
+				traced.set("bytes", int(response.headers.get("Content-Length") or 0))
+				return response
+
+# Spans are named for the endpoint (see ratelimit.py), Dropbox calls by their route
+def spanName(url):
+	endpoint = ratelimit.endpointFor(url)
+	if endpoint == "dropbox":
+		return f"dropbox {urlparse(url).path.replace('/2/', '', 1)}"
+	return endpoint or urlparse(url).hostname
+
+# A request already being traced (by request() below, or a download) adds to that span, anything
+# else, like the Dropbox SDK's calls, gets its own
+def _span(method, url):
+	traced = trace.current()
+	if traced.category in ("http", "download"):
+		return contextlib.nullcontext(traced)
+	return trace.span(spanName(url), "http", method=method)
+
+_session = None
+_lock = threading.Lock()
+
+def configure(**options):
+	global _session
+	with _lock:
+		settings.update(options)
+		# Throw away the old session so the next request picks up the new settings
+		if _session is not None:
+			_session.close()
+			_session = None
+
+def getSession():
+	global _session
+	with _lock:
+		if _session is None:
+			session = LimitedSession()
+			adapter = HTTPAdapter(pool_connections=settings["poolConnections"], pool_maxsize=settings["poolSize"])
+			session.mount("https://", adapter)
+			session.mount("http://", adapter)
+			for host, size in settings["hostPoolSizes"].items():
+				session.mount(f"https://{host}", HTTPAdapter(pool_connections=1, pool_maxsize=size))
+			_session = session
+		return _session
+
+def close():
+	configure()
+
+# Failed requests are retried with a jittered backoff (see retry.py). Pass idempotent=True for a POST
+# that's safe to send twice, or retries=0 to handle failures yourself.
+def request(method, url, retries=None, idempotent=None, **kwargs):
+	kwargs.setdefault("timeout", (settings["connectTimeout"], settings["readTimeout"]))
+	if retries is None:
+		retries = retry.settings["retries"]
+	if idempotent is None:
+		idempotent = method.upper() in retry.idempotentMethods
+
+	# However many attempts it takes, the breaker sees this as one request
+	breaker = retry.getBreaker(url)
+	breaker.allow()
+	token = _retrying.set(True)
+	try:
+		response = _send(method, url, retries, idempotent, **kwargs)
+	except Exception as e:
+		breaker.record(retry.classify(error=e) != "retryable")
+		raise
+	finally:
+		_retrying.reset(token)
+	breaker.record(response.status_code < 500)
+	return response
+
+def _send(method, url, retries, idempotent, **kwargs):
+	# A file being uploaded needs to be rewound before it can be sent again
+	body = kwargs.get("data")
+	start = body.tell() if hasattr(body, "seek") else None
+
+	with _span(method, url) as traced:
+		attempt = 0
+		while True:
+			if start is not None:
+				body.seek(start)
+			try:
+				response = getSession().request(method, url, **kwargs)
+			except requests.RequestException as e:
+				if attempt >= retries or not retry.canReplay(e, idempotent):
+					raise
+				delay = retry.backoff(attempt)
+			else:
+				if attempt >= retries or not retry.canReplay(response, idempotent):
+					return response
+				delay = retry.backoff(attempt, response)
+				response.close()
+			attempt += 1
+			traced.set("retries", attempt)
+			time.sleep(delay)
+
+def get(url, **kwargs):
+	return request("GET", url, **kwargs)
+
+def post(url, **kwargs):
+	return request("POST", url, **kwargs)
+
+def put(url, **kwargs):
+	return request("PUT", url, **kwargs)
@@ -0,0 +1,107 @@
+# A tiny dependency graph scheduler for asyncio pipelines. Each task names the tasks it depends on
+# and starts the moment those are done, rather than waiting for an entire stage to finish. With
+# everything expressed this way, a run takes roughly as long as its longest chain of dependent calls
+# instead of the sum of every stage.
+#
+# Tasks run through an aio.Pipeline if one is given, so the concurrency cap still applies. A task
+# only takes a slot once its dependencies are done, so waiting never ties one up.
+
+import time
+import asyncio
+from ffservices import trace
+
+class DependencyFailed(Exception):
+	pass
+
+class TaskGraph:
+
+	def __init__(self, pipeline=None):
+		self.pipeline = pipeline
+		self.nodes = {}
+		self.results = {}
+		self.errors = {}
+		self.timings = {}
+
+	# fn gets called with the results of deps, in order, and should return an awaitable
+	def add(self, name, fn, deps=()):
+		if name in self.nodes:
+			raise ValueError(f"Task {name} was already added")
+		self.nodes[name] = { "fn":fn, "deps":list(deps) }
+		return name
+
+	async def run(self):
+		self._validate()
+
+		self._tasks = {}
+		for name in self.nodes:
+			self._task(name)
+		await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+		return self.results
+
+	# Longest chain of tasks (by finish time) that led to the last task to finish
+	def criticalPath(self):
+		if not self.timings:
+			return []
+		name = max(self.timings, key=lambda n: self.timings[n]["end"])
+		path = []
+		while name is not None:
+			path.append({ "name":name, "duration":self.timings[name]["end"] - self.timings[name]["start"] })
+			deps = [dep for dep in self.nodes[name]["deps"] if dep in self.timings]
+			name = max(deps, key=lambda n: self.timings[n]["end"]) if deps else None
+		return list(reversed(path))
+
+	# How many tasks ran for each stage, and how long they took in total and at most. A task's stage is
+	# its name up to the first ":", ex: expand:some prompt is in the expand stage.
+	def stages(self):
+		stages = {}
+		for (name, timing) in self.timings.items():
+			duration = timing["end"] - timing["start"]
+			stage = stages.setdefault(name.split(":")[0], { "tasks":0, "total":0, "longest":0 })
+			stage["tasks"] += 1
+			stage["total"] += duration
+			stage["longest"] = max(stage["longest"], duration)
+		return stages
+
+	def _validate(self):
+		# Walk the graph to catch missing tasks and cycles up front, either would hang the run
+		state = {}
+		def visit(name, path):
+			if state.get(name) == "done":
+				return
+			if state.get(name) == "visiting":
+				raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+			state[name] = "visiting"
+			for dep in self.nodes[name]["deps"]:
+				if dep not in self.nodes:
+					raise ValueError(f"Task {name} depends on unknown task {dep}")
+				visit(dep, path + [name])
+			state[name] = "done"
+		for name in self.nodes:
+			visit(name, [])
+
+	def _task(self, name):
+		if name not in self._tasks:
+			self._tasks[name] = asyncio.ensure_future(self._runNode(name))
+		return self._tasks[name]
+
+	async def _runNode(self, name):
+		node = self.nodes[name]
+		try:
+			args = [await self._task(dep) for dep in node["deps"]]
+		except Exception as e:
+			self.errors[name] = e if isinstance(e, DependencyFailed) else DependencyFailed(f"{name} skipped, a dependency failed: {e}")
+			raise self.errors[name]
+
+		start = time.monotonic()
+		try:
+			with trace.span(name, "stage", stage=name.split(":")[0]):
+				if self.pipeline is not None:
+					result = await self.pipeline.call(node["fn"], *args)
+				else:
+					result = await node["fn"](*args)
+		except Exception as e:
+			self.errors[name] = e
+			raise
+		self.timings[name] = { "start":start, "end":time.monotonic() }
+		self.results[name] = result
+		return result
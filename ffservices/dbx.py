@@ -0,0 +1,256 @@
+# Dropbox helpers shared by the pipeline scripts. Same helpers the scripts have always had, except
+# they take the Dropbox client as their first argument instead of relying on a global.
+
+import os
+import json
+import time
+import threading
+import dropbox
+from dropbox.exceptions import ApiError, AuthError
+from dropbox.sharing import CreateSharedLinkWithSettingsError, FileLinkMetadata
+from dropbox.files import CommitInfo, FileMetadata, WriteMode, UploadSessionCursor, UploadSessionFinishArg
+from concurrent.futures import ThreadPoolExecutor
+from ffservices import client
+
+# Upload session appends need to be a multiple of 4MB
+uploadChunkSize = 8 * 1024 * 1024
+# Most entries Dropbox will take in one finish batch
+finishBatchLimit = 1000
+
+def dropbox_connect(app_key, app_secret, refresh_token):
+	try:
+		# Share our session, so Dropbox calls get pooled connections and go through the rate limiter
+		dbx = dropbox.Dropbox(app_key=app_key, app_secret=app_secret, oauth2_refresh_token=refresh_token, session=client.getSession())
+	except AuthError as e:
+		print('Error connecting to Dropbox with access token: ' + str(e))
+	return dbx
+
+def dropbox_upload(dbx, f, folder):
+	newName = folder + '/' + f.split('/')[-1]
+	with open(f,'rb') as file:
+		dbx.files_upload(file.read(), newName, mode=WriteMode.overwrite)
+
+# Sends one file up through an upload session, a chunk at a time, so only one chunk is ever in
+# memory. Returns the closed session's cursor, ready to be committed.
+def dropbox_upload_session(dbx, f):
+	size = os.path.getsize(f)
+	with open(f,'rb') as file:
+		chunk = file.read(uploadChunkSize)
+		session = dbx.files_upload_session_start(chunk, close=len(chunk) >= size)
+		cursor = UploadSessionCursor(session_id=session.session_id, offset=len(chunk))
+		while cursor.offset < size:
+			chunk = file.read(uploadChunkSize)
+			dbx.files_upload_session_append_v2(chunk, cursor, close=cursor.offset + len(chunk) >= size)
+			cursor.offset += len(chunk)
+	return cursor
+
+# Uploads a bunch of files into folder. The files go up in parallel through upload sessions, and
+# then get committed together with a single finish batch call (per 1000 files). Returns the
+# Dropbox paths, in the same order as files.
+def dropbox_upload_batch(dbx, files, folder, workers=4):
+	if not files:
+		return []
+
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		cursors = list(executor.map(lambda f: dropbox_upload_session(dbx, f), files))
+
+	paths = [folder + '/' + f.split('/')[-1] for f in files]
+	entries = [UploadSessionFinishArg(cursor=cursor, commit=CommitInfo(path=path, mode=WriteMode.overwrite)) for (cursor, path) in zip(cursors, paths)]
+
+	for start in range(0, len(entries), finishBatchLimit):
+		result = dbx.files_upload_session_finish_batch_v2(entries[start:start + finishBatchLimit])
+		for (path, entry) in zip(paths[start:], result.entries):
+			if entry.is_failure():
+				raise Exception(f"Dropbox upload of {path} failed: {entry.get_failure()}")
+
+	return paths
+
+def dropbox_get_read_link(dbx, path):
+	link = dbx.sharing_create_shared_link(path).url
+	return link.replace("dl=0","dl=1")
+
+def dropbox_get_upload_link(dbx, path):
+	commit_info = CommitInfo(path=path, mode=WriteMode.overwrite)
+	return dbx.files_get_temporary_upload_link(commit_info).link
+
+linkCacheFile = os.environ.get('FF_DROPBOX_LINK_CACHE', os.path.join(os.path.expanduser("~"), ".cache", "ffservices", "dropbox_links.json"))
+
+# Remembers shared links so we don't make a sharing call every time we need a readable link (the
+# PSD template used to get a new one for every prompt). Links are stored by path along with the
+# file revision they were made for, in memory and on disk. prefetch() pulls every existing link
+# in one paginated listing. A cached link from an earlier run gets its revision checked once
+# before we trust it, and a new revision means a new link.
+class LinkCache:
+
+	def __init__(self, dbx, cachePath=None):
+		self.dbx = dbx
+		self.cachePath = cachePath or linkCacheFile
+		self._lock = threading.Lock()
+		self.links = self._load()
+		# Paths we've confirmed are current during this run
+		self.checked = set()
+
+	def prefetch(self):
+		cursor = None
+		while True:
+			result = self.dbx.sharing_list_shared_links(cursor=cursor) if cursor else self.dbx.sharing_list_shared_links()
+			with self._lock:
+				for link in result.links:
+					if isinstance(link, FileLinkMetadata) and link.path_lower:
+						self.links[link.path_lower] = { "url":link.url, "rev":link.rev }
+						self.checked.add(link.path_lower)
+			if not result.has_more:
+				break
+			cursor = result.cursor
+		self._save()
+
+	# Returns a direct download link for path. Pass rev if you know it (ex: from an upload) to skip
+	# the revision check.
+	def get(self, path, rev=None):
+		key = path.lower()
+		with self._lock:
+			entry = self.links.get(key)
+			if entry and (rev == entry["rev"] or (rev is None and key in self.checked)):
+				return _directLink(entry["url"])
+
+		if entry and rev is None:
+			rev = self.dbx.files_get_metadata(path).rev
+			if rev == entry["rev"]:
+				with self._lock:
+					self.checked.add(key)
+				return _directLink(entry["url"])
+
+		link = self._createLink(path)
+		with self._lock:
+			self.links[key] = { "url":link.url, "rev":link.rev }
+			self.checked.add(key)
+		self._save()
+		return _directLink(link.url)
+
+	# For when we know the file just changed
+	def invalidate(self, path):
+		with self._lock:
+			self.links.pop(path.lower(), None)
+			self.checked.discard(path.lower())
+
+	def _createLink(self, path):
+		try:
+			return self.dbx.sharing_create_shared_link_with_settings(path)
+		except ApiError as e:
+			if not (isinstance(e.error, CreateSharedLinkWithSettingsError) and e.error.is_shared_link_already_exists()):
+				raise
+			# Dropbox usually hands back the existing link with the error, otherwise go look it up
+			existing = e.error.get_shared_link_already_exists()
+			if existing is not None and existing.is_metadata():
+				return existing.get_metadata()
+			return self.dbx.sharing_list_shared_links(path=path, direct_only=True).links[0]
+
+	def _load(self):
+		try:
+			with open(self.cachePath, "r") as file:
+				return json.load(file)
+		except (OSError, ValueError):
+			return {}
+
+	def _save(self):
+		with self._lock:
+			links = dict(self.links)
+		os.makedirs(os.path.dirname(self.cachePath), exist_ok=True)
+		temp = f"{self.cachePath}.{os.getpid()}.{threading.get_ident()}.tmp"
+		with open(temp, "w") as file:
+			json.dump(links, file)
+		os.replace(temp, self.cachePath)
+
+def _directLink(url):
+	return url.replace("dl=0","dl=1")
+
+# Temporary upload links are good for four hours (the most Dropbox allows), and each one can only
+# be used once. The broker mints them ahead of time on a pool of workers, so by the time a render
+# needs somewhere to write, its link is usually already waiting. Links that would expire before
+# they're used get minted again.
+class UploadLinkBroker:
+
+	def __init__(self, dbx, workers=8, lifetime=4 * 60 * 60, margin=15 * 60):
+		self.dbx = dbx
+		self.lifetime = lifetime
+		self.margin = margin
+		self._executor = ThreadPoolExecutor(max_workers=workers)
+		self._lock = threading.Lock()
+		self._pending = {}
+
+	# Start minting links for all of these paths in the background
+	def prefetch(self, paths):
+		with self._lock:
+			for path in paths:
+				if path not in self._pending:
+					self._pending[path] = self._executor.submit(self._mint, path)
+
+	# Hands out the link for path, waiting on it if it's still being minted. Each link is only
+	# handed out once, since Dropbox only lets it be used once.
+	def get(self, path):
+		with self._lock:
+			future = self._pending.pop(path, None)
+		if future is not None:
+			link, expiresAt = future.result()
+			if expiresAt - self.margin > time.time():
+				return link
+		return self._mint(path)[0]
+
+	def close(self):
+		self._executor.shutdown(wait=False, cancel_futures=True)
+
+	def _mint(self, path):
+		expiresAt = time.time() + self.lifetime
+		commit_info = CommitInfo(path=path, mode=WriteMode.overwrite)
+		return self.dbx.files_get_temporary_upload_link(commit_info, duration=self.lifetime).link, expiresAt
+
+# Lists a folder a page at a time, following the continue cursor, and yields files as each page
+# comes in, so work can start on the first page while the rest are still being fetched. If given
+# a cursorFile, the cursor is saved after every page, and with resume on the next run picks up
+# from there and only sees what's changed since. wait() long polls for changes to the folder.
+class FolderLister:
+
+	def __init__(self, dbx, path, cursorFile=None, resume=True, recursive=False):
+		self.dbx = dbx
+		self.path = path
+		self.cursorFile = cursorFile
+		self.recursive = recursive
+		self.cursor = self._loadCursor() if resume else None
+
+	# Yields FileMetadata entries, skipping folders and deletions
+	def files(self):
+		if self.cursor:
+			result = self.dbx.files_list_folder_continue(self.cursor)
+		else:
+			result = self.dbx.files_list_folder(self.path, recursive=self.recursive)
+
+		while True:
+			for entry in result.entries:
+				if isinstance(entry, FileMetadata):
+					yield entry
+			self._saveCursor(result.cursor)
+			if not result.has_more:
+				break
+			result = self.dbx.files_list_folder_continue(self.cursor)
+
+	# Blocks until something in the folder changes (returns True) or the timeout runs out (False).
+	# Dropbox may ask us to back off before polling again, so we respect that here.
+	def wait(self, timeout=30):
+		if not self.cursor:
+			self._saveCursor(self.dbx.files_list_folder_get_latest_cursor(self.path, recursive=self.recursive).cursor)
+		result = self.dbx.files_list_folder_longpoll(self.cursor, timeout=timeout)
+		if result.backoff:
+			time.sleep(result.backoff)
+		return result.changes
+
+	def _loadCursor(self):
+		if self.cursorFile and os.path.exists(self.cursorFile):
+			with open(self.cursorFile, "r") as file:
+				return file.read().strip() or None
+		return None
+
+	def _saveCursor(self, cursor):
+		self.cursor = cursor
+		if self.cursorFile:
+			with open(self.cursorFile, "w") as file:
+				file.write(cursor)
@@ -0,0 +1,30 @@
+# Somewhere for failed units of work to go so the rest of a batch can keep moving. Each failure is
+# appended to a JSON lines file with what failed, the error, and what kind of error it was
+# (retryable, quota, or fatal), so the batch can be looked over or rerun later.
+
+import json
+import time
+import threading
+from ffservices.retry import classify
+
+class DeadLetter:
+
+	def __init__(self, path):
+		self.path = path
+		self.count = 0
+		self._lock = threading.Lock()
+
+	def add(self, unit, error, **details):
+		entry = { "time":time.time(), "unit":unit, "kind":classify(error=error), "error":str(error), **details }
+		with self._lock:
+			with open(self.path, "a") as file:
+				file.write(json.dumps(entry) + "\n")
+			self.count += 1
+		return entry
+
+	def entries(self):
+		try:
+			with open(self.path, "r") as file:
+				return [json.loads(line) for line in file if line.strip()]
+		except OSError:
+			return []
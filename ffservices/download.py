@@ -0,0 +1,180 @@
+# Download helpers. Images are streamed to disk in chunks instead of reading the whole response
+# into memory with .content, and are written to a temp file that only gets renamed into place once
+# it's complete (and optionally matches an expected checksum), so a failed download never leaves a
+# half written image behind.
+
+import os
+import time
+import random
+import hashlib
+import threading
+import requests
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from ffservices import client, trace
+
+chunkSize = 64 * 1024
+
+class ChecksumMismatch(Exception):
+	pass
+
+# checksum is an expected hex digest, using whatever hashlib algorithm is named
+def downloadFile(url, filePath, checksum=None, algorithm="sha256"):
+	temp = f"{filePath}.part"
+	digest = hashlib.new(algorithm) if checksum else None
+
+	try:
+		with trace.span("download", "download", file=filePath) as traced, client.get(url, stream=True) as response:
+			response.raise_for_status()
+			with open(temp, 'wb') as output:
+				for chunk in response.iter_content(chunkSize):
+					output.write(chunk)
+					if digest:
+						digest.update(chunk)
+				traced.set("bytes", output.tell())
+
+		if digest and digest.hexdigest() != checksum.lower():
+			raise ChecksumMismatch(f"{url} should have {algorithm} {checksum} but got {digest.hexdigest()}")
+
+		os.replace(temp, filePath)
+	finally:
+		if os.path.exists(temp):
+			os.remove(temp)
+
+	return filePath
+
+# Takes a list of (url, filePath) pairs. At most workers downloads run at once, each holding
+# one chunk in memory at a time, so memory stays flat no matter how many files there are.
+def downloadFiles(items, workers=4, progress=False):
+	with DownloadManager(workers=workers, progress=progress) as manager:
+		for (url, filePath) in items:
+			manager.add(url, filePath)
+		return manager.wait()
+
+# Errors worth another try, S3 sends 500/503 when it wants you to slow down
+retryStatuses = (408, 429, 500, 502, 503, 504)
+
+class TransientError(Exception):
+	pass
+
+# A pool of download workers for grabbing a batch of presigned URLs at link speed. It limits how
+# many connections go to any one host, retries transient failures, and resumes partial downloads
+# with a Range request rather than starting over. Progress and throughput get reported as files
+# finish.
+class DownloadManager:
+
+	def __init__(self, workers=8, perHost=4, retries=4, backoff=1, progress=True):
+		self.workers = workers
+		self.perHost = perHost
+		self.retries = retries
+		self.backoff = backoff
+		self.progress = progress
+		self._executor = ThreadPoolExecutor(max_workers=workers)
+		self._hostLimits = {}
+		self._lock = threading.Lock()
+		self._futures = []
+		self.bytes = 0
+		self.done = 0
+		self.total = 0
+		self.started = None
+
+	def add(self, url, filePath, checksum=None, algorithm="sha256"):
+		with self._lock:
+			if self.started is None:
+				self.started = time.monotonic()
+			self.total += 1
+		future = self._executor.submit(self._download, url, filePath, checksum, algorithm)
+		self._futures.append(future)
+		return future
+
+	# Waits for everything added so far, returns the saved paths in the order they were added
+	def wait(self):
+		futures, self._futures = self._futures, []
+		return [future.result() for future in futures]
+
+	def close(self):
+		self._executor.shutdown(wait=True)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def throughput(self):
+		elapsed = time.monotonic() - self.started if self.started else 0
+		return self.bytes / elapsed if elapsed else 0
+
+	def summary(self):
+		return f"{self.done} file(s), {self.bytes / 1024 / 1024:.1f} MB at {self.throughput() / 1024 / 1024:.1f} MB/s"
+
+	def _hostLimit(self, url):
+		host = urlparse(url).netloc
+		with self._lock:
+			if host not in self._hostLimits:
+				self._hostLimits[host] = threading.Semaphore(self.perHost)
+			return self._hostLimits[host]
+
+	def _download(self, url, filePath, checksum, algorithm):
+		temp = f"{filePath}.part"
+		if os.path.exists(temp):
+			os.remove(temp)
+
+		attempt = 0
+		with trace.span("download", "download", file=filePath) as traced:
+			while True:
+				try:
+					with self._hostLimit(url):
+						self._transfer(url, temp)
+					break
+				except (TransientError, requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+					attempt += 1
+					traced.set("retries", attempt)
+					if attempt > self.retries:
+						if os.path.exists(temp):
+							os.remove(temp)
+						raise
+					# Keep whatever we got, the next attempt picks up from there
+					time.sleep(self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+			traced.set("bytes", os.path.getsize(temp))
+
+		if checksum:
+			actual = hashFile(temp, algorithm)
+			if actual != checksum.lower():
+				os.remove(temp)
+				raise ChecksumMismatch(f"{url} should have {algorithm} {checksum} but got {actual}")
+
+		os.replace(temp, filePath)
+		with self._lock:
+			self.done += 1
+			if self.progress:
+				print(f"Downloaded {filePath} ({self.done} of {self.total}, {self.throughput() / 1024 / 1024:.1f} MB/s)")
+		return filePath
+
+	# We retry ourselves (resuming where we left off), so the client doesn't
+	def _transfer(self, url, temp):
+		offset = os.path.getsize(temp) if os.path.exists(temp) else 0
+		headers = { "Range":f"bytes={offset}-" } if offset else {}
+
+		with client.get(url, stream=True, headers=headers, retries=0) as response:
+			if response.status_code in retryStatuses:
+				raise TransientError(f"{url} returned {response.status_code}")
+			# Already have all of it
+			if response.status_code == 416 and offset:
+				return
+			response.raise_for_status()
+
+			# A 200 means the server ignored the Range header, so start over
+			mode = 'ab' if response.status_code == 206 else 'wb'
+			with open(temp, mode) as output:
+				for chunk in response.iter_content(chunkSize):
+					output.write(chunk)
+					with self._lock:
+						self.bytes += len(chunk)
+
+def hashFile(path, algorithm="sha256"):
+	digest = hashlib.new(algorithm)
+	with open(path, 'rb') as file:
+		for chunk in iter(lambda: file.read(chunkSize), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
@@ -0,0 +1,144 @@
+# Firefly API helpers shared by the pipeline scripts. These use the v3 generate/expand endpoints,
+# which work with image URLs rather than upload ids.
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from ffservices import client
+from ffservices.retry import raiseForStatus
+
+FIREFLY_API = "https://firefly-api.adobe.io"
+
+def uploadImage(path, id, token):
+	
+	with open(path,'rb') as file:
+
+		response = client.post(f"{FIREFLY_API}/v2/storage/image", data=file, headers = {
+			"X-API-Key":id, 
+			"Authorization":f"Bearer {token}",
+			"Content-Type": "image/jpeg"
+		}, idempotent=True) 
+		raiseForStatus(response)
+
+		# Simplify the return a bit... 
+		return response.json()["images"][0]["id"]
+
+# The whole output, with its seed as well as the image. Passing the seed from an earlier output
+# generates that same image again.
+def textToImageOutput(text, imageId, id, token, size="1024x1024", seed=None):
+
+	width, height = size.split('x')
+
+	data = {
+		"numVariations":1,
+		"prompt":text,
+		"contentClass":"photo",
+		"size":{
+			"width":int(width),
+			"height":int(height)
+		},
+		"style":{
+			"imageReference":{
+				"source":{
+					"uploadId":imageId
+				}
+			}
+		}
+	}
+
+	if seed is not None:
+		data["seeds"] = [seed]
+
+	response = client.post(f"{FIREFLY_API}/v3/images/generate", json=data, headers = {
+		"X-API-Key":id, 
+		"Authorization":f"Bearer {token}",
+		"Content-Type":"application/json"
+	}, idempotent=True) 
+	raiseForStatus(response)
+
+	return response.json()["outputs"][0]
+
+def textToImage(text, imageId, id, token, size="1024x1024"):
+	return textToImageOutput(text, imageId, id, token, size)["image"]["url"]
+
+def generativeExpand(imageUrl, size, id, token):
+
+	width, height = size.split('x')
+
+	data = {
+		"numVariations":1,
+		"image":{
+			"source":{
+				"url":imageUrl
+			}
+		},
+		"size":{
+			"width":int(width), 
+			"height":int(height)
+		}
+	}
+
+	response = client.post(f"{FIREFLY_API}/v3/images/expand", json=data, headers = {
+		"X-API-Key":id, 
+		"Authorization":f"Bearer {token}",
+		"Content-Type":"application/json"
+	}, idempotent=True)
+	raiseForStatus(response)
+
+	return response.json()["outputs"][0]["image"]["url"]
+
+# Expands one image to a whole list of sizes at once, so a prompt takes as long as its slowest size
+# instead of all of them added up. Expansions are remembered by (image, size), so asking for the
+# same one again (ex: two prompts that share a source image) gets the same result instead of
+# another call.
+class Expander:
+
+	def __init__(self, workers=8):
+		self._executor = ThreadPoolExecutor(max_workers=workers)
+		self._lock = threading.Lock()
+		self._futures = {}
+
+	# Returns a size -> Future map. sourceSize, if given, is the size the image already is, so it
+	# maps straight to imageUrl.
+	def submit(self, imageUrl, sizes, id, token, sourceSize=None):
+		futures = {}
+		started = []
+		with self._lock:
+			for size in sizes:
+				if size == sourceSize:
+					futures[size] = Future()
+					futures[size].set_result(imageUrl)
+					continue
+				key = (imageUrl, size)
+				if key not in self._futures:
+					self._futures[key] = self._executor.submit(generativeExpand, imageUrl, size, id, token)
+					started.append(key)
+				futures[size] = self._futures[key]
+		# Outside the lock, since the callback runs right away (and takes the lock) if the expand
+		# already failed
+		for key in started:
+			futures[key[1]].add_done_callback(lambda future, key=key: self._forgetFailure(key, future))
+		return futures
+
+	# Returns a size -> URL map
+	def expand(self, imageUrl, sizes, id, token, sourceSize=None):
+		return { size:future.result() for (size, future) in self.submit(imageUrl, sizes, id, token, sourceSize).items() }
+
+	# A failed expand shouldn't stick, the next ask should try again
+	def _forgetFailure(self, key, future):
+		if future.exception() is not None:
+			with self._lock:
+				if self._futures.get(key) is future:
+					del self._futures[key]
+
+_expander = None
+_expanderLock = threading.Lock()
+
+def getExpander():
+	global _expander
+	with _expanderLock:
+		if _expander is None:
+			_expander = Expander()
+		return _expander
+
+def expandSizes(imageUrl, sizes, id, token, sourceSize=None):
+	return getExpander().expand(imageUrl, sizes, id, token, sourceSize)
@@ -0,0 +1,487 @@
+# A local stand in for IMS, Firefly, Photoshop and Dropbox, so the pipelines can be run (and load
+# tested) without touching the real services or burning quota. Start it, then point the scripts at
+# it with FF_BASE_URL:
+#
+#   python -m ffservices.mockserver --port 8900 --config mock.json
+#   FF_BASE_URL=http://localhost:8900 python t2i.py "a cat on a skateboard" 4
+#
+# It implements the token endpoint, /v2/storage/image, the generate and expand endpoints, cutout,
+# documentOperations (and the other psdService calls), job status, and the Dropbox calls the
+# scripts make. Generated images, Photoshop outputs and Dropbox files all live in memory.
+#
+# Each endpoint (named like in ratelimit.py, with "default" for the rest) can be configured with:
+#
+#   latency, jitter  - seconds to wait before answering, plus up to jitter more at random
+#   failureRate      - fraction of requests that get a 500
+#   throttleRate     - fraction of requests that get a 429
+#   rateLimit        - requests per second allowed before the server starts sending 429s
+#   retryAfter       - the Retry-After sent with a 429
+#   jobTime          - for Photoshop jobs, how long they stay running
+#   jobFailureRate   - for Photoshop jobs, fraction that end up failed
+#
+# ex: {"default": {"latency": 0.05}, "firefly-generate": {"latency": 2, "rateLimit": 5}, "cutout": {"jobTime": 3}}
+
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+defaults = {
+	"default":            { "latency":0.05, "jitter":0.02, "failureRate":0, "throttleRate":0, "rateLimit":None, "retryAfter":1, "jobTime":1, "jobFailureRate":0 },
+	"firefly-generate":   { "latency":1, "jitter":0.5 },
+	"firefly-expand":     { "latency":1, "jitter":0.5 },
+	"cutout":             { "jobTime":2 },
+	"documentOperations": { "jobTime":4 },
+	"files":              { "latency":0.01, "jitter":0 }
+}
+
+# How big the fake images we hand out are
+imageBytes = 200 * 1024
+
+# Photoshop job status URLs point at the real host, so the client routes them here the same way it
+# does everything else (and rate limits them like the real thing)
+PHOTOSHOP_API = "https://image.adobe.io"
+
+class MockServer:
+
+	def __init__(self, config=None, host="127.0.0.1", port=0):
+		self.config = { name:dict(options) for (name, options) in defaults.items() }
+		for (name, options) in (config or {}).items():
+			self.config.setdefault(name, {}).update(options)
+		self.host = host
+		self.port = port
+		self.url = None
+		self.image = b"\xff\xd8\xff\xe0" + os.urandom(imageBytes - 6) + b"\xff\xd9"
+		self._lock = threading.Lock()
+		self._changed = threading.Condition(self._lock)
+		self._server = None
+		self.reset()
+
+	def reset(self):
+		with self._lock:
+			self.counts = {}
+			self.recent = {}
+			self.jobs = {}
+			self.files = {}
+			self.sessions = {}
+			self.uploadLinks = {}
+			self.sharedLinks = {}
+			self.changes = []
+			self.inFlight = 0
+			self.maxInFlight = 0
+
+	def start(self):
+		self._server = ThreadingHTTPServer((self.host, self.port), _handlerFor(self))
+		self._server.daemon_threads = True
+		self.port = self._server.server_address[1]
+		self.url = f"http://{self.host}:{self.port}"
+		threading.Thread(target=self._server.serve_forever, daemon=True).start()
+		return self.url
+
+	def stop(self):
+		if self._server is not None:
+			self._server.shutdown()
+			self._server.server_close()
+			self._server = None
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *args):
+		self.stop()
+
+	def options(self, endpoint):
+		return { **self.config["default"], **self.config.get(endpoint, {}) }
+
+	def stats(self):
+		with self._lock:
+			return { "endpoints":{ name:dict(counts) for (name, counts) in self.counts.items() }, "maxInFlight":self.maxInFlight, "jobs":len(self.jobs), "files":len(self.files) }
+
+	# Latency, injected failures and throttling. Returns a status code to fail with, or None.
+	def admit(self, endpoint):
+		options = self.options(endpoint)
+		with self._lock:
+			counts = self.counts.setdefault(endpoint, { "requests":0, "failed":0, "throttled":0 })
+			counts["requests"] += 1
+			status = None
+			if options["rateLimit"]:
+				window = self.recent.setdefault(endpoint, deque())
+				now = time.monotonic()
+				while window and now - window[0] > 1:
+					window.popleft()
+				if len(window) >= options["rateLimit"]:
+					status = 429
+				else:
+					window.append(now)
+			if status is None and random.random() < options["throttleRate"]:
+				status = 429
+			elif status is None and random.random() < options["failureRate"]:
+				status = 500
+			if status == 429:
+				counts["throttled"] += 1
+			elif status == 500:
+				counts["failed"] += 1
+		time.sleep(options["latency"] + random.uniform(0, options["jitter"]))
+		return status
+
+	def enter(self):
+		with self._lock:
+			self.inFlight += 1
+			self.maxInFlight = max(self.maxInFlight, self.inFlight)
+
+	def leave(self):
+		with self._lock:
+			self.inFlight -= 1
+
+	# Firefly
+
+	def imageUrl(self):
+		return f"{self.url}/files/{uuid.uuid4().hex}.jpg"
+
+	def generated(self, data, path):
+		count = data.get("numVariations") or data.get("n") or 1
+		seeds = data.get("seeds") or [random.randint(0, 999999) for _ in range(count)]
+		outputs = []
+		for seed in seeds[:count]:
+			url = self.imageUrl()
+			outputs.append({ "seed":seed, "image":{ "id":uuid.uuid4().hex, "url":url, "presignedUrl":url } })
+		# v1 expand named these images
+		if path.startswith("/v1/"):
+			return { "images":outputs, "size":data.get("size") }
+		return { "outputs":outputs, "size":data.get("size"), "contentClass":data.get("contentClass") }
+
+	# Photoshop
+
+	def createJob(self, kind, data):
+		options = self.options(kind)
+		jobId = uuid.uuid4().hex
+		if kind == "cutout":
+			outputs = [data.get("output", {})]
+			statusUrl = f"{PHOTOSHOP_API}/sensei/status/{jobId}"
+		else:
+			outputs = data.get("outputs", [])
+			statusUrl = f"{PHOTOSHOP_API}/pie/psdService/status/{jobId}"
+		with self._lock:
+			self.jobs[jobId] = {
+				"kind":kind,
+				"input":data.get("input") or (data.get("inputs") or [{}])[0],
+				"outputs":outputs,
+				"done":time.time() + options["jobTime"],
+				"failed":random.random() < options["jobFailureRate"],
+				"written":False
+			}
+		return { "_links":{ "self":{ "href":statusUrl } } }
+
+	def jobStatus(self, jobId):
+		with self._lock:
+			job = self.jobs.get(jobId)
+		if job is None:
+			return None
+		status = "running"
+		if time.time() >= job["done"]:
+			status = "failed" if job["failed"] else "succeeded"
+			if status == "succeeded" and not job["written"]:
+				job["written"] = True
+				for output in job["outputs"]:
+					self.writeOutput(output.get("href", ""))
+
+		if job["kind"] == "cutout":
+			return { "jobID":jobId, "status":status, "input":job["input"].get("href"), "output":job["outputs"][0] }
+		renditions = [{ "href":output.get("href"), "storage":output.get("storage"), "type":output.get("type") } for output in job["outputs"]]
+		return { "jobId":jobId, "outputs":[{ "input":job["input"].get("href"), "status":status, "_links":{ "renditions":renditions } }] }
+
+	# Outputs written to one of our upload links land in the fake Dropbox
+	def writeOutput(self, href):
+		token = href.rsplit("/upload/", 1)[-1] if "/upload/" in href else None
+		with self._lock:
+			path = self.uploadLinks.pop(token, None) if token else None
+		if path:
+			self.putFile(path, self.image)
+
+	# Dropbox
+
+	def putFile(self, path, data):
+		with self._lock:
+			entry = { "path":path, "data":data, "rev":uuid.uuid4().hex[:16], "modified":datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ") }
+			self.files[path.lower()] = entry
+			self.changes.append(path.lower())
+			self._changed.notify_all()
+			return self.metadata(entry)
+
+	def metadata(self, entry):
+		path = entry["path"]
+		return {
+			".tag":"file",
+			"name":path.rsplit("/", 1)[-1],
+			"id":f"id:{entry['rev']}",
+			"client_modified":entry["modified"],
+			"server_modified":entry["modified"],
+			"rev":entry["rev"],
+			"size":len(entry["data"]),
+			"path_lower":path.lower(),
+			"path_display":path
+		}
+
+	def listFolder(self, folder, recursive, since):
+		folder = folder.lower().rstrip("/")
+		with self._lock:
+			changed = set(self.changes[since:]) if since is not None else set(self.files.keys())
+			entries = [self.metadata(self.files[path]) for path in sorted(changed) if path in self.files and self.inFolder(path, folder, recursive)]
+			return entries, len(self.changes)
+
+	def inFolder(self, path, folder, recursive):
+		if not path.startswith(folder + "/"):
+			return False
+		return recursive or "/" not in path[len(folder) + 1:]
+
+	def cursor(self, folder, recursive, position):
+		return f"{folder}|{int(recursive)}|{position}"
+
+	def longpoll(self, cursor, timeout):
+		folder, recursive, position = cursor.rsplit("|", 2)
+		deadline = time.time() + timeout
+		with self._lock:
+			while True:
+				if any(self.inFolder(path, folder.lower().rstrip("/"), recursive == "1") for path in self.changes[int(position):]):
+					return True
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					return False
+				self._changed.wait(remaining)
+
+	def sharedLink(self, path):
+		with self._lock:
+			entry = self.files.get(path.lower())
+			if entry is None:
+				return None
+			linkId = uuid.uuid4().hex[:12]
+			self.sharedLinks[linkId] = path.lower()
+			meta = self.metadata(entry)
+		return { **meta, "url":f"{self.url}/s/{linkId}/{meta['name']}?dl=0", "link_permissions":linkPermissions }
+
+	def dropbox(self, route, args, body):
+		if route == "files/upload":
+			return self.putFile(args["path"], body)
+		if route == "files/upload_session/start":
+			sessionId = uuid.uuid4().hex
+			with self._lock:
+				self.sessions[sessionId] = bytearray(body)
+			return { "session_id":sessionId }
+		if route == "files/upload_session/append_v2":
+			with self._lock:
+				self.sessions[args["cursor"]["session_id"]].extend(body)
+			return None
+		if route == "files/upload_session/finish_batch_v2":
+			entries = []
+			for entry in args["entries"]:
+				with self._lock:
+					data = bytes(self.sessions.pop(entry["cursor"]["session_id"], b""))
+				entries.append({ **self.putFile(entry["commit"]["path"], data), ".tag":"success" })
+			return { "entries":entries }
+		if route == "files/get_temporary_upload_link":
+			token = uuid.uuid4().hex
+			with self._lock:
+				self.uploadLinks[token] = args["commit_info"]["path"]
+			return { "link":f"{self.url}/upload/{token}" }
+		if route == "files/get_metadata":
+			with self._lock:
+				entry = self.files.get(args["path"].lower())
+			if entry is None:
+				return _notFound()
+			return self.metadata(entry)
+		if route in ("files/list_folder", "files/list_folder/get_latest_cursor"):
+			entries, position = self.listFolder(args["path"], args.get("recursive", False), None)
+			cursor = self.cursor(args["path"], args.get("recursive", False), position)
+			if route == "files/list_folder/get_latest_cursor":
+				return { "cursor":cursor }
+			return { "entries":entries, "cursor":cursor, "has_more":False }
+		if route == "files/list_folder/continue":
+			folder, recursive, position = args["cursor"].rsplit("|", 2)
+			entries, position = self.listFolder(folder, recursive == "1", int(position))
+			return { "entries":entries, "cursor":self.cursor(folder, recursive == "1", position), "has_more":False }
+		if route == "files/list_folder/longpoll":
+			return { "changes":self.longpoll(args["cursor"], min(args.get("timeout", 30), 480)) }
+		if route in ("sharing/create_shared_link", "sharing/create_shared_link_with_settings"):
+			link = self.sharedLink(args["path"])
+			if link is None:
+				return _notFound()
+			if route == "sharing/create_shared_link":
+				return { "url":link["url"], "path":link["path_display"], "visibility":{ ".tag":"public" } }
+			return link
+		if route == "sharing/list_shared_links":
+			links = []
+			if args.get("path"):
+				link = self.sharedLink(args["path"])
+				links = [link] if link else []
+			return { "links":links, "has_more":False }
+		return _notFound()
+
+	def fileFor(self, linkId):
+		with self._lock:
+			entry = self.files.get(self.sharedLinks.get(linkId, ""))
+			return entry["data"] if entry else None
+
+# Everything the SDK insists a shared link's permissions have
+linkPermissions = {
+	"can_revoke":True,
+	"visibility_policies":[],
+	"can_set_expiry":False,
+	"can_remove_expiry":False,
+	"allow_download":True,
+	"can_allow_download":True,
+	"can_disallow_download":False,
+	"allow_comments":False,
+	"team_restricts_comments":False
+}
+
+def _notFound():
+	return (409, { "error_summary":"path/not_found/", "error":{ ".tag":"path", "path":{ ".tag":"not_found" } } })
+
+# Which configured endpoint a request counts against
+def endpointFor(method, path):
+	if "/ims/token" in path:
+		return "ims"
+	if path.startswith("/2/") or path == "/oauth2/token":
+		return "dropbox"
+	if path.startswith("/files/") or path.startswith("/upload/") or path.startswith("/s/"):
+		return "files"
+	if "/storage/image" in path:
+		return "firefly-upload"
+	if path.endswith("/images/generate"):
+		return "firefly-generate"
+	if path.endswith("/images/expand"):
+		return "firefly-expand"
+	if "/status/" in path:
+		return "jobStatus"
+	if path.startswith("/sensei/"):
+		return "cutout"
+	if path.startswith("/pie/psdService/"):
+		return "documentOperations"
+	return "default"
+
+def _handlerFor(mock):
+
+	class Handler(BaseHTTPRequestHandler):
+
+		protocol_version = "HTTP/1.1"
+
+		def log_message(self, *args):
+			pass
+
+		def do_GET(self):
+			self.handle_request("GET")
+
+		def do_POST(self):
+			self.handle_request("POST")
+
+		def do_PUT(self):
+			self.handle_request("PUT")
+
+		def handle_request(self, method):
+			path = urlparse(self.path).path
+			body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+			if path == "/_mock/stats":
+				return self.send_json(200, mock.stats())
+			if path == "/_mock/reset":
+				mock.reset()
+				return self.send_json(200, {})
+
+			endpoint = endpointFor(method, path)
+			mock.enter()
+			try:
+				status = mock.admit(endpoint)
+				if status == 429:
+					self.send_bytes(429, b"Too many requests", "text/plain", { "Retry-After":str(math.ceil(mock.options(endpoint)["retryAfter"])) })
+				elif status:
+					self.send_json(status, { "error_code":"internal_error", "message":"Injected failure" })
+				else:
+					self.route(method, path, endpoint, body)
+			finally:
+				mock.leave()
+
+		def route(self, method, path, endpoint, body):
+			if endpoint == "ims" or path == "/oauth2/token":
+				return self.send_json(200, { "access_token":f"mock-{uuid.uuid4().hex}", "token_type":"bearer", "expires_in":86399 })
+
+			if endpoint == "files":
+				if path.startswith("/upload/"):
+					mock.writeOutput(path)
+					return self.send_json(200, {})
+				data = mock.fileFor(path.split("/")[2]) if path.startswith("/s/") else mock.image
+				if data is None:
+					return self.send_json(404, { "message":"Not found" })
+				return self.send_bytes(200, data, "image/jpeg")
+
+			if endpoint == "dropbox":
+				argHeader = self.headers.get("Dropbox-API-Arg")
+				args = json.loads(argHeader) if argHeader else (json.loads(body) if body else {})
+				result = mock.dropbox(path[len("/2/"):], args, body if argHeader else b"")
+				if isinstance(result, tuple):
+					return self.send_json(*result)
+				if result is None:
+					return self.send_bytes(200, b"null", "application/json")
+				return self.send_json(200, result)
+
+			if endpoint == "firefly-upload":
+				return self.send_json(200, { "images":[{ "id":uuid.uuid4().hex }] })
+
+			if endpoint in ("firefly-generate", "firefly-expand"):
+				return self.send_json(200, mock.generated(json.loads(body or b"{}"), path))
+
+			if endpoint == "jobStatus":
+				status = mock.jobStatus(path.rstrip("/").rsplit("/", 1)[-1])
+				if status is None:
+					return self.send_json(404, { "message":"Unknown job" })
+				return self.send_json(200, status)
+
+			if endpoint in ("cutout", "documentOperations") and method == "POST":
+				return self.send_json(202, mock.createJob(endpoint, json.loads(body or b"{}")))
+
+			self.send_json(404, { "message":f"The mock server doesn't know {method} {path}" })
+
+		def send_json(self, status, data):
+			self.send_bytes(status, json.dumps(data).encode("utf-8"), "application/json")
+
+		def send_bytes(self, status, data, contentType, headers=None):
+			self.send_response(status)
+			self.send_header("Content-Type", contentType)
+			self.send_header("Content-Length", str(len(data)))
+			for (name, value) in (headers or {}).items():
+				self.send_header(name, value)
+			self.end_headers()
+			self.wfile.write(data)
+
+	return Handler
+
+def loadConfig(path):
+	if not path:
+		return {}
+	with open(path, "r") as file:
+		return json.load(file)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Local mock of the IMS, Firefly, Photoshop and Dropbox APIs")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8900)
+	parser.add_argument("--config", default=os.environ.get('FF_MOCK_CONFIG'), help="JSON file of per endpoint settings")
+	args = parser.parse_args()
+
+	server = MockServer(loadConfig(args.config), args.host, args.port)
+	print(f"Mock server running at {server.start()}, use FF_BASE_URL={server.url}")
+	try:
+		while True:
+			time.sleep(60)
+	except KeyboardInterrupt:
+		server.stop()
+		sys.exit(0)
@@ -0,0 +1,151 @@
+# Photoshop API helpers shared by the pipeline scripts: remove background, PSD edits, and job polling.
+
+import os
+from ffservices import client
+from ffservices.retry import raiseForStatus
+# Jobs are polled by the shared poller, pollJob lives there now but is still available from here
+from ffservices.poller import getJobStatus, pollJob, submitJob
+
+PHOTOSHOP_API = "https://image.adobe.io"
+
+def createRemoveBackgroundJob(input, output, id, token):
+	
+	data = {
+		"input": {
+			"href":input, 
+			"storage":"dropbox"
+		},
+		"output":{
+			"href":output, 
+			"storage":"dropbox"
+		}
+	}
+	# Not idempotent, a second job would race the first for the same single use upload link
+	response = client.post(f"{PHOTOSHOP_API}/sensei/cutout", headers = {"Authorization": f"Bearer {token}", "x-api-key": id }, json=data)
+	raiseForStatus(response)
+	return response.json()
+
+# The layer edits and outputs for one render of the banner template, in every size
+def outputRender(koProduct, sizes, sizeUrls, outputs, text):
+
+	render = { "layers":[], "outputs":[] }
+
+	for (x,size) in enumerate(sizes):
+		width, height = size.split('x')
+		url = sizeUrls[size]
+		render["layers"].append({
+			"name":f"{width}x{height}-text",
+			"edit":{},
+			"text":{
+				"content":text
+			}
+		})
+
+		render["layers"].append({
+			"name":f"{width}x{height}-background",
+			"edit":{},
+			"input":{
+				"storage":"external", 
+				"href":url
+			}
+		})
+
+		render["layers"].append({
+			"name":f"{width}x{height}-product",
+			"edit":{},
+			"input":{
+				"storage":"external", 
+				"href":koProduct
+			}
+		})
+
+		render["outputs"].append({
+			"href":outputs[x], 
+			"storage":"dropbox",
+			"type":"image/jpeg",
+			"trimToCanvas":True,
+			"layers":[{
+				"name":f"{width}x{height}"
+			}]
+	
+		})
+
+	return render
+
+def createDocumentJob(psd, layers, outputs, id, token):
+
+	data = {
+		"inputs": [{
+			"href":psd, 
+			"storage":"dropbox"
+		}],
+		"options":{
+			"layers":layers
+		},
+		"outputs":outputs
+	}
+
+	# Not idempotent either, for the same reason as cutout
+	response = client.post(f"{PHOTOSHOP_API}/pie/psdService/documentOperations", headers = {"Authorization": f"Bearer {token}", "x-api-key": id }, json=data)
+	raiseForStatus(response)
+	return response.json()
+
+def createOutput(psd, koProduct, sizes, sizeUrls, outputs, text, id, token):
+	render = outputRender(koProduct, sizes, sizeUrls, outputs, text)
+	return createDocumentJob(psd, render["layers"], render["outputs"], id, token)
+
+# Most outputs we'll put in a single documentOperations request
+maxOutputs = int(os.environ.get('FF_MAX_OUTPUTS', 25))
+
+# A set of renders sharing one documentOperations job. Layer edits apply to the whole document, so
+# two renders can only share a job if they don't edit the same layer in different ways. Every
+# member remembers where its outputs start, so the results map back to it.
+class OutputPack:
+
+	def __init__(self):
+		self.layers = {}
+		self.outputs = []
+		self.members = []
+
+	def fits(self, render, limit):
+		if len(self.outputs) + len(render["outputs"]) > limit:
+			return False
+		return all(self.layers.get(layer["name"], layer) == layer for layer in render["layers"])
+
+	def add(self, key, render):
+		for layer in render["layers"]:
+			self.layers[layer["name"]] = layer
+		self.members.append((key, len(self.outputs), len(render["outputs"])))
+		self.outputs.extend(render["outputs"])
+
+	# Splits a finished job back up into key -> { status, renditions }
+	def results(self, result):
+		status = getJobStatus(result)
+		renditions = result["outputs"][0].get("_links", {}).get("renditions", []) if result.get("outputs") else []
+		return { key:{ "status":status, "renditions":renditions[start:start + count] } for (key, start, count) in self.members }
+
+# Packs a key -> render map into as few jobs as possible, first fit
+def packRenders(renders, limit=None):
+	limit = limit or maxOutputs
+	packs = []
+	for (key, render) in renders.items():
+		pack = next((pack for pack in packs if pack.fits(render, limit)), None)
+		if pack is None:
+			pack = OutputPack()
+			packs.append(pack)
+		pack.add(key, render)
+	return packs
+
+# Sends every render through as few documentOperations jobs as possible, waits on all of them
+# together, and returns key -> { status, renditions }. token can be a function, like for the poller.
+def renderPacked(psd, renders, id, token, limit=None):
+	packs = packRenders(renders, limit)
+	futures = []
+	for pack in packs:
+		job = createDocumentJob(psd, list(pack.layers.values()), pack.outputs, id, token() if callable(token) else token)
+		futures.append((pack, submitJob(job, id, token, "documentOperations")))
+
+	results = {}
+	for (pack, future) in futures:
+		results.update(pack.results(future.result()))
+	return results
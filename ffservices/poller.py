@@ -0,0 +1,228 @@
+# One poller for every in-flight Photoshop job. Rather than each job blocking its own thread on
+# time.sleep(3), jobs get registered here by their _links.self.href URL and one background thread
+# checks whichever ones are due, a handful at a time over the shared connection pool. Each job gets
+# a Future that resolves once the job hits succeeded or failed, so hundreds of cutout and
+# documentOperations jobs can be in flight together.
+#
+# The schedule adapts to how long each kind of job actually takes. We keep a history of observed
+# job latencies per endpoint (persisted between runs), make the first poll around the expected
+# completion time, and back off exponentially (with jitter) after that. A quick cutout doesn't sit
+# around waiting on a fixed 3 second sleep, and a slow PSD render doesn't get hammered.
+
+import os
+import json
+import time
+import random
+import atexit
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from ffservices import client, trace
+from ffservices.trace import percentile
+
+statsFile = os.environ.get('FF_POLL_STATS', os.path.join(os.path.expanduser("~"), ".cache", "ffservices", "poll_stats.json"))
+
+# How many recent latencies we remember per endpoint
+historySize = 200
+
+# Cutout jobs report status at the top level, PSD jobs report it per output
+def getJobStatus(json_response):
+	if "status" in json_response:
+		return json_response["status"]
+	elif "status" in json_response["outputs"][0]:
+		return json_response["outputs"][0]["status"]
+	return ""
+
+def isJobDone(status):
+	return status == 'succeeded' or status == 'failed'
+
+# Status URLs for actionJSON and documentOperations look the same, so callers that know better
+# can pass the kind in explicitly.
+def jobKind(jobUrl):
+	if "/sensei/" in jobUrl:
+		return "cutout"
+	if "/pie/psdService/" in jobUrl:
+		return "documentOperations"
+	return "other"
+
+class JobPoller:
+
+	def __init__(self, interval=3, minDelay=0.5, maxDelay=30, backoff=1.5, workers=10, maxErrors=5, statsPath=None):
+		# Used until we've seen a few jobs of a given kind
+		self.interval = interval
+		self.minDelay = minDelay
+		self.maxDelay = maxDelay
+		self.backoff = backoff
+		self.maxErrors = maxErrors
+		self.statsPath = statsPath or statsFile
+		self._jobs = {}
+		self._lock = threading.Lock()
+		self._wake = threading.Event()
+		self._executor = ThreadPoolExecutor(max_workers=workers)
+		self._thread = None
+		self._stopped = False
+		self._history = self._loadHistory()
+		self._counts = {}
+		self._lastSave = time.monotonic()
+		atexit.register(self.saveHistory)
+
+	# token can be a string or a function returning one, the latter is handy for long jobs
+	# since it lets the token cache hand out a fresh token on each poll.
+	def submit(self, job, id, token, kind=None):
+		jobUrl = job["_links"]["self"]["href"]
+		kind = kind or jobKind(jobUrl)
+		future = Future()
+		now = time.monotonic()
+		with self._lock:
+			self._jobs[jobUrl] = { "url":jobUrl, "id":id, "token":token, "kind":kind, "future":future, "submitted":now, "polls":0, "errors":0, "polling":False, "nextPoll":now + self._firstDelay(kind) }
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, daemon=True)
+				self._thread.start()
+		self._wake.set()
+		return future
+
+	def pending(self):
+		with self._lock:
+			return len(self._jobs)
+
+	def stop(self):
+		self._stopped = True
+		self._wake.set()
+		self.saveHistory()
+
+	# Per endpoint summary: expected latency and how many status requests jobs needed
+	def stats(self):
+		with self._lock:
+			result = {}
+			for kind in set(self._history) | set(self._counts):
+				history = self._history.get(kind, [])
+				counts = self._counts.get(kind, [])
+				result[kind] = {
+					"jobs":len(counts),
+					"polls":sum(counts),
+					"pollsPerJob":sum(counts) / len(counts) if counts else None,
+					"maxPolls":max(counts, default=None),
+					"latencyP50":percentile(history, 50),
+					"latencyP90":percentile(history, 90)
+				}
+			return result
+
+	def saveHistory(self):
+		with self._lock:
+			history = { kind:values[-historySize:] for kind,values in self._history.items() }
+		try:
+			os.makedirs(os.path.dirname(self.statsPath), exist_ok=True)
+			temp = f"{self.statsPath}.{os.getpid()}.tmp"
+			with open(temp, "w") as file:
+				json.dump(history, file)
+			os.replace(temp, self.statsPath)
+		except OSError as e:
+			print(f"Unable to save poll stats: {e}")
+		self._lastSave = time.monotonic()
+
+	def _loadHistory(self):
+		try:
+			with open(self.statsPath, "r") as file:
+				return json.load(file)
+		except (OSError, ValueError):
+			return {}
+
+	# Aim the first poll a little before the typical completion time for this kind of job
+	def _firstDelay(self, kind):
+		history = self._history.get(kind, [])
+		if len(history) < 3:
+			return self.interval
+		return min(max(percentile(history, 50) * 0.9, self.minDelay), self.maxDelay)
+
+	# After the first miss, start small relative to the typical latency and grow from there
+	def _nextDelay(self, entry):
+		history = self._history.get(entry["kind"], [])
+		if len(history) < 3:
+			base = self.interval
+		else:
+			base = max(percentile(history, 50) * 0.2, self.minDelay)
+		delay = min(base * (self.backoff ** (entry["polls"] - 1)), self.maxDelay)
+		return delay * random.uniform(0.75, 1.25)
+
+	def _run(self):
+		while not self._stopped:
+			now = time.monotonic()
+			with self._lock:
+				due = [entry for entry in self._jobs.values() if entry["nextPoll"] <= now and not entry["polling"]]
+				for entry in due:
+					entry["polling"] = True
+
+			# Each poll reschedules its own job when it comes back, so a slow status call only
+			# holds up that one job and not everyone else
+			for entry in due:
+				self._executor.submit(self._poll, entry).add_done_callback(lambda future, entry=entry: self._polled(entry, future))
+
+			if time.monotonic() - self._lastSave > 10:
+				self.saveHistory()
+
+			self._wake.clear()
+			with self._lock:
+				nextPoll = min([entry["nextPoll"] for entry in self._jobs.values() if not entry["polling"]], default=None)
+			self._wake.wait(None if nextPoll is None else max(nextPoll - time.monotonic(), 0))
+
+	def _polled(self, entry, future):
+		# Anything _poll didn't handle fails just that job
+		if future.exception() is not None and not entry["future"].done():
+			self._finish(entry, exception=future.exception())
+		with self._lock:
+			entry["polling"] = False
+		self._wake.set()
+
+	def _poll(self, entry):
+		entry["polls"] += 1
+		try:
+			# Getting the token can mean a call to IMS, so it can fail like the poll itself
+			token = entry["token"]() if callable(entry["token"]) else entry["token"]
+			# No retries here, a failed poll just counts towards maxErrors and gets tried again later
+			response = client.get(entry["url"], headers = {"Authorization": f"Bearer {token}", "x-api-key": entry["id"] }, retries=0)
+			json_response = response.json()
+			status = getJobStatus(json_response)
+		except Exception as e:
+			entry["errors"] += 1
+			if entry["errors"] >= self.maxErrors:
+				self._finish(entry, exception=e)
+			else:
+				entry["nextPoll"] = time.monotonic() + self._nextDelay(entry)
+			return
+
+		if isJobDone(status):
+			self._finish(entry, result=json_response)
+		else:
+			entry["errors"] = 0
+			entry["nextPoll"] = time.monotonic() + self._nextDelay(entry)
+
+	def _finish(self, entry, result=None, exception=None):
+		with self._lock:
+			self._jobs.pop(entry["url"], None)
+			self._counts.setdefault(entry["kind"], []).append(entry["polls"])
+			# Only successful polls tell us anything about how long the job takes
+			if exception is None:
+				history = self._history.setdefault(entry["kind"], [])
+				history.append(time.monotonic() - entry["submitted"])
+				del history[:-historySize]
+		trace.record(f"{entry['kind']} job", "job", entry["submitted"], time.monotonic(), polls=entry["polls"], status=getJobStatus(result) if result else "error")
+		if exception is not None:
+			entry["future"].set_exception(exception)
+		else:
+			entry["future"].set_result(result)
+
+_poller = None
+_pollerLock = threading.Lock()
+
+def getPoller():
+	global _poller
+	with _pollerLock:
+		if _poller is None:
+			_poller = JobPoller()
+		return _poller
+
+def submitJob(job, id, token, kind=None):
+	return getPoller().submit(job, id, token, kind)
+
+# Drop in replacement for the old per-script pollJob
+def pollJob(job, id, token, kind=None):
+	return submitJob(job, id, token, kind).result()
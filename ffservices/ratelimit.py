@@ -0,0 +1,150 @@
+# Rate limiting for every API we call. Each endpoint (Firefly generate, expand, Photoshop cutout,
+# documentOperations, Dropbox, ...) gets one token bucket shared by every thread in the process, so
+# it doesn't matter how many workers a script starts, the endpoint only sees requests as fast as
+# its bucket allows. Each endpoint also caps how many requests it has in flight at once.
+#
+# The rate adapts. Every successful response nudges it up a little (towards max), and a 429 cuts it
+# in half and pauses the endpoint for as long as Retry-After asks. Over a run the rate settles just
+# under whatever the service will actually sustain, instead of us guessing at a worker count.
+
+import os
+import json
+import time
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+# rate is where each endpoint starts (requests per second), max is as fast as we'll ever go, and
+# concurrency is the most requests in flight at once. FF_RATE_LIMITS takes JSON to override any
+# of these, ex: {"firefly-generate": {"rate": 1, "max": 4}}. The Firefly ones match on any adobe.io
+# host, since the scripts use both firefly-api and firefly-beta.
+endpoints = {
+	"ims":                { "host":"adobelogin.com", "path":"/ims/token", "rate":1, "max":5, "concurrency":2 },
+	"firefly-upload":     { "host":"adobe.io", "path":"/storage/image", "rate":5, "max":20, "concurrency":10 },
+	"firefly-generate":   { "host":"adobe.io", "path":"/images/generate", "rate":2, "max":10, "concurrency":10 },
+	"firefly-expand":     { "host":"adobe.io", "path":"/images/expand", "rate":2, "max":10, "concurrency":10 },
+	"cutout":             { "host":"image.adobe.io", "path":"/sensei/cutout", "rate":2, "max":10, "concurrency":10 },
+	"documentOperations": { "host":"image.adobe.io", "path":"/pie/psdService/documentOperations", "rate":2, "max":10, "concurrency":10 },
+	"jobStatus":          { "host":"image.adobe.io", "path":"/status", "rate":10, "max":50, "concurrency":20 },
+	"dropbox":            { "host":"dropboxapi.com", "path":"", "rate":10, "max":50, "concurrency":20 }
+}
+
+for (name, options) in json.loads(os.environ.get('FF_RATE_LIMITS', '{}')).items():
+	endpoints.setdefault(name, { "host":"", "path":"", "rate":1, "max":1, "concurrency":1 }).update(options)
+
+# Set FF_RATE_LIMIT=0 to turn limiting off entirely
+enabled = os.environ.get('FF_RATE_LIMIT', '1') != '0'
+
+# How long to back off after a 429 that didn't say
+defaultRetryAfter = 2
+# The rate never drops below this, so an endpoint can always recover
+minRate = 0.1
+
+class TokenBucket:
+
+	def __init__(self, name, rate, maxRate, concurrency, burst=None):
+		self.name = name
+		self.rate = float(rate)
+		self.maxRate = float(maxRate)
+		self.burst = burst or max(1, int(rate))
+		self.tokens = float(self.burst)
+		self.updated = time.monotonic()
+		self.pausedUntil = 0
+		self.requests = 0
+		self.throttled = 0
+		self._lock = threading.Lock()
+		self._slots = threading.BoundedSemaphore(concurrency)
+
+	# Blocks until there's both a free slot and a token
+	def acquire(self):
+		self._slots.acquire()
+		while True:
+			with self._lock:
+				now = time.monotonic()
+				self._refill(now)
+				if now >= self.pausedUntil and self.tokens >= 1:
+					self.tokens -= 1
+					self.requests += 1
+					return
+				wait = max(self.pausedUntil - now, (1 - self.tokens) / self.rate)
+			time.sleep(wait)
+
+	def release(self):
+		self._slots.release()
+
+	# Additive increase on success, halve the rate on a 429
+	def update(self, response):
+		with self._lock:
+			if response.status_code == 429:
+				self.throttled += 1
+				self.rate = max(minRate, self.rate / 2)
+				self.tokens = 0
+				self.pausedUntil = max(self.pausedUntil, time.monotonic() + retryAfter(response, defaultRetryAfter))
+			elif response.status_code == 503 and "Retry-After" in response.headers:
+				self.pausedUntil = max(self.pausedUntil, time.monotonic() + retryAfter(response, defaultRetryAfter))
+			elif response.status_code < 400:
+				self.rate = min(self.maxRate, self.rate + 0.5 / self.rate)
+
+	def _refill(self, now):
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, *args):
+		self.release()
+
+# Retry-After is either a number of seconds or an HTTP date
+def retryAfter(response, default=None):
+	value = response.headers.get("Retry-After")
+	if value is None:
+		return default
+	try:
+		return max(0, float(value))
+	except ValueError:
+		pass
+	try:
+		return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+	except (TypeError, ValueError):
+		return default
+
+_buckets = {}
+_lock = threading.Lock()
+
+def endpointFor(url):
+	parsed = urlparse(url)
+	for (name, options) in endpoints.items():
+		if options["host"] and (parsed.hostname or "").endswith(options["host"]) and options["path"] in parsed.path:
+			return name
+	return None
+
+def getBucket(name):
+	with _lock:
+		if name not in _buckets:
+			options = endpoints[name]
+			_buckets[name] = TokenBucket(name, options["rate"], options["max"], options["concurrency"], options.get("burst"))
+		return _buckets[name]
+
+class _NoLimit:
+
+	def update(self, response):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		pass
+
+# Use as a context manager around a request, and call update() with the response
+def limit(url):
+	name = endpointFor(url) if enabled else None
+	return getBucket(name) if name else _NoLimit()
+
+# Where each endpoint's rate has settled, and how often it pushed back
+def stats():
+	with _lock:
+		buckets = list(_buckets.values())
+	return { bucket.name:{ "rate":round(bucket.rate, 2), "requests":bucket.requests, "throttled":bucket.throttled } for bucket in buckets }
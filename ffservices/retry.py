@@ -0,0 +1,144 @@
+# Retry policy and circuit breakers for every request made through client.py. Failures are sorted
+# into three kinds:
+#
+#   retryable - connection errors, timeouts, 408/429/5xx. Worth another try after a jittered backoff.
+#   quota     - 402, or a 403/429 that says it's about quota. Trying again won't help until it resets.
+#   fatal     - any other 4xx. The request itself is wrong.
+#
+# Only requests that are safe to send twice get replayed. GET/PUT/DELETE always are, POSTs only when
+# the caller says so or when the response makes it clear the first one was never processed (a 429 or
+# 503, or a connect timeout). The Firefly helpers say so, since a repeat just generates another
+# image. Photoshop job creation doesn't, because a repeat starts a second job writing to the same
+# single use Dropbox upload link.
+#
+# Each host also gets a circuit breaker. After enough failed requests in a row (a request counts once,
+# however many attempts its retries took) the breaker opens and requests to that host fail right
+# away with CircuitOpen, rather than every worker sitting through its own backoff against a service
+# that's down. After a cooldown one request is let through to test the waters, and if it works the
+# breaker closes again.
+
+import os
+import time
+import random
+import threading
+import requests
+from urllib.parse import urlparse
+from ffservices.ratelimit import retryAfter
+
+settings = {
+	"retries": int(os.environ.get('FF_RETRIES', 5)),
+	# Backoff doubles from here on each attempt, with full jitter
+	"backoff": float(os.environ.get('FF_RETRY_BACKOFF', 1)),
+	"maxBackoff": 60,
+	# Failures in a row before a host's breaker opens, and how long it stays open
+	"breakerThreshold": int(os.environ.get('FF_BREAKER_THRESHOLD', 5)),
+	"breakerCooldown": float(os.environ.get('FF_BREAKER_COOLDOWN', 30))
+}
+
+retryStatuses = (408, 425, 429, 500, 502, 503, 504)
+# These mean the request wasn't processed, so even a POST can go again
+unprocessedStatuses = (429, 503)
+idempotentMethods = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+class RequestError(Exception):
+
+	def __init__(self, message, kind, status=None, body=None):
+		super().__init__(message)
+		self.kind = kind
+		self.status = status
+		self.body = body
+
+class RetryableError(RequestError):
+	pass
+
+class QuotaError(RequestError):
+	pass
+
+class FatalError(RequestError):
+	pass
+
+class CircuitOpen(RetryableError):
+	pass
+
+def classify(response=None, error=None):
+	if error is not None:
+		if isinstance(error, RequestError):
+			return error.kind
+		if isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)):
+			return "retryable"
+		return "fatal"
+
+	status = response.status_code
+	if status < 400:
+		return None
+	if status == 402 or (status in (403, 429) and "quota" in response.text.lower()):
+		return "quota"
+	if status in retryStatuses:
+		return "retryable"
+	return "fatal"
+
+# Whether a failed attempt (a response or a requests exception) should be sent again
+def canReplay(outcome, idempotent):
+	if isinstance(outcome, requests.ConnectTimeout):
+		# Never made it to the server
+		return True
+	if isinstance(outcome, Exception):
+		return idempotent and classify(error=outcome) == "retryable"
+	return classify(outcome) == "retryable" and (idempotent or outcome.status_code in unprocessedStatuses)
+
+def backoff(attempt, response=None):
+	delay = random.uniform(0, min(settings["maxBackoff"], settings["backoff"] * (2 ** attempt)))
+	wait = retryAfter(response) if response is not None else None
+	return max(delay, wait or 0)
+
+# For the helpers that used to assume the call worked. Raises the right kind of error for a bad
+# response, with whatever the API said about it.
+def raiseForStatus(response):
+	kind = classify(response)
+	if kind is None:
+		return response
+	message = f"{response.request.method} {response.url} returned {response.status_code}: {response.text[:500]}"
+	errorClass = { "retryable":RetryableError, "quota":QuotaError, "fatal":FatalError }[kind]
+	raise errorClass(message, kind, response.status_code, response.text)
+
+class CircuitBreaker:
+
+	def __init__(self, host, threshold=None, cooldown=None):
+		self.host = host
+		self.threshold = threshold or settings["breakerThreshold"]
+		self.cooldown = cooldown or settings["breakerCooldown"]
+		self.failures = 0
+		self.openedAt = None
+		self.trial = False
+		self._lock = threading.Lock()
+
+	# Raises CircuitOpen if requests to this host shouldn't go out right now
+	def allow(self):
+		with self._lock:
+			if self.openedAt is None:
+				return
+			if time.monotonic() - self.openedAt < self.cooldown or self.trial:
+				raise CircuitOpen(f"Circuit open for {self.host} after {self.failures} failures in a row", "retryable")
+			# Half open, let this one through as a test
+			self.trial = True
+
+	def record(self, ok):
+		with self._lock:
+			self.trial = False
+			if ok:
+				self.failures = 0
+				self.openedAt = None
+			else:
+				self.failures += 1
+				if self.failures >= self.threshold:
+					self.openedAt = time.monotonic()
+
+_breakers = {}
+_lock = threading.Lock()
+
+def getBreaker(url):
+	host = urlparse(url).hostname or ""
+	with _lock:
+		if host not in _breakers:
+			_breakers[host] = CircuitBreaker(host)
+		return _breakers[host]
@@ -0,0 +1,75 @@
+# Generates the same prompt in a bunch of styles at once. Every style's request goes out together
+# (up to workers at a time), and as soon as one comes back its images start downloading while the
+# rest are still generating. The results are collected into a grid, one row per style and one
+# column per variation, and written out as a manifest.
+#
+# generate(style) makes the request and returns the API response. It can instead return
+# (response, saved paths) when it already has the images, ex: from the asset cache, and nothing is
+# downloaded for that style. nameFor(style, output) says where to save each image, and onSaved, if
+# given, is called with (style, response, saved paths) once a style's downloads are done.
+
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ffservices.cache import imageUrl
+from ffservices.download import DownloadManager
+
+class StyleSweep:
+
+	def __init__(self, workers=8, downloadWorkers=8):
+		self.workers = workers
+		self.downloadWorkers = downloadWorkers
+
+	def run(self, styles, generate, nameFor, onSaved=None):
+		rows = { style:{ "style":style, "images":[] } for style in styles }
+		# Styles whose images are being downloaded here, and their responses
+		responses = {}
+		downloads = []
+
+		with DownloadManager(workers=self.downloadWorkers, progress=False) as manager, ThreadPoolExecutor(max_workers=self.workers) as executor:
+			futures = { executor.submit(generate, style):style for style in styles }
+			for future in as_completed(futures):
+				style = futures[future]
+				try:
+					result = future.result()
+					response, saved = result if isinstance(result, tuple) else (result, None)
+					outputs = response["outputs"]
+				except Exception as e:
+					print(f"Style {style} failed: {e}")
+					rows[style]["error"] = str(e)
+					continue
+
+				print(f"Generated style: {style}")
+				if saved is not None:
+					rows[style]["images"] = [{ "seed":output.get("seed"), "file":path } for (output, path) in zip(outputs, saved)]
+					rows[style]["cached"] = True
+					continue
+
+				responses[style] = response
+				for output in outputs:
+					path = nameFor(style, output)
+					rows[style]["images"].append({ "seed":output.get("seed"), "file":path })
+					downloads.append((style, manager.add(imageUrl(output), path)))
+
+			# Generation is done, now just wait on whatever's still downloading
+			for (style, download) in downloads:
+				try:
+					download.result()
+				except Exception as e:
+					print(f"Download for style {style} failed: {e}")
+					rows[style]["error"] = str(e)
+
+		if onSaved is not None:
+			for (style, response) in responses.items():
+				if "error" not in rows[style]:
+					onSaved(style, response, [image["file"] for image in rows[style]["images"]])
+
+		return [rows[style] for style in styles]
+
+# Writes the grid, one row per style in the order they were asked for
+def writeManifest(path, rows, **details):
+	grid = { **details, "columns":max((len(row["images"]) for row in rows), default=0), "rows":rows }
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	with open(path, "w") as file:
+		json.dump(grid, file, indent=2)
+	return path
@@ -0,0 +1,192 @@
+# Span based tracing for the pipelines. Every API call, download, Photoshop job and pipeline stage
+# gets a span with its start, end and a few attributes (endpoint, status, bytes, retries, ...). At
+# the end of the run the spans can be written out as a Chrome trace, which opens in Perfetto
+# (https://ui.perfetto.dev) or chrome://tracing as a timeline, and summed up into a table of
+# p50/p95/p99 latency per endpoint.
+#
+# Set FF_TRACE to a file name to turn it on for any script, the trace is written and the summary
+# printed when the script exits. When tracing is off, span() does nothing.
+
+import os
+import json
+import time
+import atexit
+import threading
+import contextvars
+
+# Spans beyond this are dropped, so a very long run can't eat all the memory
+maxSpans = 1000000
+
+# Which spans show up in the summary table
+summaryCategories = ("http", "download", "job")
+
+enabled = False
+_path = None
+_spans = []
+_lock = threading.Lock()
+_started = time.monotonic()
+# Spans nest per thread and per asyncio task, so this has to be a context variable
+_current = contextvars.ContextVar("span", default=None)
+
+def percentile(values, pct):
+	if not values:
+		return None
+	ordered = sorted(values)
+	return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+class Span:
+
+	def __init__(self, name, category, attrs):
+		self.name = name
+		self.category = category
+		self.attrs = attrs
+		self.start = None
+		self.end = None
+		self._token = None
+
+	def set(self, key, value):
+		self.attrs[key] = value
+		return self
+
+	def add(self, key, value):
+		self.attrs[key] = self.attrs.get(key, 0) + value
+		return self
+
+	def __enter__(self):
+		self.start = time.monotonic()
+		self._token = _current.set(self)
+		return self
+
+	def __exit__(self, errorType, error, tb):
+		self.end = time.monotonic()
+		_current.reset(self._token)
+		if error is not None:
+			self.attrs.setdefault("error", f"{errorType.__name__}: {error}")
+		_record(self)
+		return False
+
+# Stands in for a span when tracing is off
+class _NoSpan:
+
+	name = None
+	category = None
+
+	def set(self, key, value):
+		return self
+
+	def add(self, key, value):
+		return self
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		return False
+
+_noSpan = _NoSpan()
+
+def enable(path=None):
+	global enabled, _path
+	enabled = True
+	_path = path
+	if path:
+		atexit.register(_finish)
+
+def span(name, category="stage", **attrs):
+	return Span(name, category, attrs) if enabled else _noSpan
+
+# The innermost span open in this thread or task, if any
+def current():
+	return _current.get() or _noSpan
+
+# For spans we only know about after the fact, like a Photoshop job's time from submit to done.
+# start and end are time.monotonic() values.
+def record(name, category, start, end, **attrs):
+	if not enabled:
+		return
+	finished = Span(name, category, attrs)
+	finished.start = start
+	finished.end = end
+	_record(finished)
+
+def _record(finished):
+	finished.thread = threading.get_ident()
+	with _lock:
+		if len(_spans) < maxSpans:
+			_spans.append(finished)
+
+def spans():
+	with _lock:
+		return list(_spans)
+
+# Per span name: count, errors and latency percentiles in seconds
+def summary(categories=summaryCategories):
+	durations = {}
+	errors = {}
+	for finished in spans():
+		if finished.category not in categories:
+			continue
+		durations.setdefault(finished.name, []).append(finished.end - finished.start)
+		status = finished.attrs.get("status")
+		failed = "error" in finished.attrs or (isinstance(status, int) and status >= 400) or status == "failed"
+		errors[finished.name] = errors.get(finished.name, 0) + (1 if failed else 0)
+	return { name:{
+		"count":len(values),
+		"errors":errors[name],
+		"p50":percentile(values, 50),
+		"p95":percentile(values, 95),
+		"p99":percentile(values, 99),
+		"max":max(values),
+		"total":sum(values)
+	} for (name, values) in sorted(durations.items()) }
+
+def printSummary():
+	rows = summary()
+	if not rows:
+		return
+	width = max(len(name) for name in rows)
+	print(f"{'endpoint'.ljust(width)}  {'count':>6}  {'errors':>6}  {'p50':>7}  {'p95':>7}  {'p99':>7}  {'max':>7}")
+	for (name, row) in rows.items():
+		print(f"{name.ljust(width)}  {row['count']:>6}  {row['errors']:>6}  {row['p50']:>6.2f}s  {row['p95']:>6.2f}s  {row['p99']:>6.2f}s  {row['max']:>6.2f}s")
+
+# Chrome trace event format. Overlapping spans on one track don't display well, and lots of async
+# tasks share a thread, so each category gets its own process in the timeline and spans are packed
+# into as few tracks ("lanes") as will hold them without overlapping.
+def export(path):
+	events = []
+	categories = {}
+	for finished in sorted(spans(), key=lambda s: s.start):
+		lanes = categories.setdefault(finished.category, [])
+		lane = next((x for (x, end) in enumerate(lanes) if end <= finished.start), None)
+		if lane is None:
+			lanes.append(0)
+			lane = len(lanes) - 1
+		lanes[lane] = finished.end
+		events.append({
+			"name":finished.name,
+			"cat":finished.category,
+			"ph":"X",
+			"ts":(finished.start - _started) * 1000000,
+			"dur":(finished.end - finished.start) * 1000000,
+			"pid":list(categories).index(finished.category) + 1,
+			"tid":lane + 1,
+			"args":{ key:value if isinstance(value, (int, float, str, bool)) or value is None else str(value) for (key, value) in finished.attrs.items() }
+		})
+	for (x, category) in enumerate(categories):
+		events.append({ "name":"process_name", "ph":"M", "pid":x + 1, "args":{ "name":category } })
+
+	temp = f"{path}.{os.getpid()}.tmp"
+	with open(temp, "w") as file:
+		json.dump({ "traceEvents":events, "displayTimeUnit":"ms" }, file)
+	os.replace(temp, path)
+	return path
+
+def _finish():
+	if not spans():
+		return
+	export(_path)
+	print(f"Trace written to {_path}")
+	printSummary()
+
+if os.environ.get('FF_TRACE'):
+	enable(os.environ['FF_TRACE'])
@@ -0,0 +1,85 @@
+# Remembers what we've already uploaded to Firefly storage. Inputs like the reference image and
+# product shots rarely change between runs, so we map each file's content hash to the upload id
+# we got back and reuse it until it expires. Changed bytes mean a new hash, and so a new upload.
+
+import os
+import json
+import time
+import threading
+from ffservices import firefly
+from ffservices.download import hashFile
+from ffservices.retry import FatalError
+
+cacheFile = os.environ.get('FF_UPLOAD_CACHE', os.path.join(os.path.expanduser("~"), ".cache", "ffservices", "uploads.json"))
+
+# How long we trust an upload id for. Firefly only keeps uploads around for a limited time, so
+# stay well inside that.
+validFor = float(os.environ.get('FF_UPLOAD_TTL_HOURS', 24)) * 60 * 60
+
+_lock = threading.Lock()
+
+def _load():
+	try:
+		with open(cacheFile, "r") as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return {}
+
+def _save(cache):
+	os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+	temp = f"{cacheFile}.{os.getpid()}.tmp"
+	with open(temp, "w") as file:
+		json.dump(cache, file)
+	os.replace(temp, cacheFile)
+
+# Upload ids belong to a set of credentials, so the client id is part of the key
+def _key(path, id):
+	return f"{id}:{hashFile(path)}"
+
+# upload() should do the actual upload and return the id, it's only called when needed
+def cachedUpload(path, id, upload):
+	key = _key(path, id)
+	with _lock:
+		entry = _load().get(key)
+	if entry and entry["expiresAt"] > time.time():
+		return entry["uploadId"]
+
+	uploadId = upload()
+	with _lock:
+		cache = { k:v for k,v in _load().items() if v["expiresAt"] > time.time() }
+		cache[key] = { "uploadId":uploadId, "uploadedAt":time.time(), "expiresAt":time.time() + validFor }
+		_save(cache)
+	return uploadId
+
+# For when the API tells us an id we thought was good is gone. With uploadId, only forgets it if
+# that's still the one we have, so an upload someone else already redid isn't thrown away.
+def forget(path, id, uploadId=None):
+	key = _key(path, id)
+	with _lock:
+		cache = _load()
+		if key in cache and (uploadId is None or cache[key]["uploadId"] == uploadId):
+			del cache[key]
+			_save(cache)
+
+# Whether an error from a request that used an upload id means Firefly doesn't have it anymore
+def isStale(error):
+	if not isinstance(error, FatalError) or error.status not in (400, 404, 410):
+		return False
+	body = (error.body or "").lower()
+	return any(word in body for word in ("upload", "expired", "not found"))
+
+# Calls use(uploadId) with the cached upload of path. If Firefly has dropped that upload before we
+# expected, it's forgotten and uploaded again, and use() gets one more try with the new id.
+def withUpload(path, id, upload, use):
+	uploadId = cachedUpload(path, id, upload)
+	try:
+		return use(uploadId)
+	except FatalError as e:
+		if not isStale(e):
+			raise
+	print(f"The upload of {path} is gone, uploading it again")
+	forget(path, id, uploadId)
+	return use(cachedUpload(path, id, upload))
+
+def uploadImage(path, id, token):
+	return cachedUpload(path, id, lambda: firefly.uploadImage(path, id, token))
@@ -1,14 +1,15 @@
 import os 
-import requests 
 import json
 import sys
 from slugify import slugify
+from ffservices import client
+from ffservices.download import DownloadManager
 
 CLIENT_ID = os.environ.get('CLIENT_ID')
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 
 def getAccessToken(id, secret):
-	response = requests.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api")
+	response = client.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api")
 	return response.json()
 
 
@@ -16,7 +17,7 @@ def uploadImage(path, id, token):
 	
 	with open(path,'rb') as file:
 
-		response = requests.post("https://firefly-beta.adobe.io/v2/storage/image", data=file, headers = {
+		response = client.post("https://firefly-beta.adobe.io/v2/storage/image", data=file, headers = {
 			"X-API-Key":id, 
 			"Authorization":f"Bearer {token}",
 			"Content-Type": "image/jpeg"
@@ -41,7 +42,7 @@ def generativeExpand(image, num, size, prompt, id, token):
 		}
 	}
 
-	response = requests.post("https://firefly-beta.adobe.io/v1/images/expand", json=data, headers = {
+	response = client.post("https://firefly-beta.adobe.io/v1/images/expand", json=data, headers = {
 		"X-API-Key":id, 
 		"Authorization":f"Bearer {token}",
 		"Content-Type":"application/json"
@@ -57,13 +58,15 @@ imageId = image["images"][0]["id"]
 response = generativeExpand(imageId, 1, "1792x1024", "dogs flying in airplanes", CLIENT_ID, accessToken)
 #print(json.dumps(response, indent=2))
 
+# All the results download in parallel
+downloads = DownloadManager()
 for resp in response["images"]:
 	# todo, make new file based on slug of prompt + seed
 	newName = "output/" + "expandexample" + "-" + str(resp["seed"]) + ".jpg"
 	imgUrl = resp["image"]["presignedUrl"]
 	print(f"Saving {newName}")
-	with open(newName,'wb') as output:
-		bits = requests.get(imgUrl, stream=True).content
-		output.write(bits)
+	downloads.add(imgUrl, newName)
 
+downloads.wait()
+print(downloads.summary())
 print("\nDone")
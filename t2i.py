@@ -1,27 +1,40 @@
 # This collects some stuff from my other scripts, but is meant to be my main CLI tool.
 
 import os 
-import requests 
 import json
 import sys
+import time
 from slugify import slugify
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ffservices import client
+from ffservices.auth import getFFAccessToken
+from ffservices.cache import AssetCache
+from ffservices.retry import raiseForStatus
+from ffservices.sweep import StyleSweep, writeManifest
 
 CLIENT_ID = os.environ.get('CLIENT_ID')
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 
-def getAccessToken(id, secret):
-	response = requests.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api")
-	return response.json()
+GENERATE_URL = "https://firefly-beta.adobe.io/v2/images/generate"
+
+# Results are cached locally by request, so running the same request again (with seeds, or with
+# FF_REUSE_SEEDS=1 set) reads from disk rather than generating again.
+cache = AssetCache(reuseSeeds=os.environ.get('FF_REUSE_SEEDS') == '1')
+
+# How many requests a batch, or a sweep of styles, runs at once
+batchWorkers = int(os.environ.get('FF_CONCURRENCY', 4))
 
-def textToImage(text, num, styles, id, token):
+def buildRequest(text, num, styles, seeds=None, size="2048x2048", contentClass="photo"):
+
+	width, height = size.split('x')
 
 	data = {
 		"n":num,
 		"prompt":text,
-		"contentClass":"photo",
+		"contentClass":contentClass,
 		"size":{
-			"width":2048,
-			"height":2048
+			"width":int(width),
+			"height":int(height)
 		}
 	}
 
@@ -29,64 +42,189 @@ def textToImage(text, num, styles, id, token):
 		data["styles"] = {}
 		data["styles"]["presets"] = styles
 
-	response = requests.post("https://firefly-beta.adobe.io/v2/images/generate", json=data, headers = {
+	if seeds:
+		data["seeds"] = seeds
+
+	return data
+
+def textToImage(data, id, token):
+
+	response = client.post(GENERATE_URL, json=data, headers = {
 		"X-API-Key":id, 
 		"Authorization":f"Bearer {token}",
 		"Content-Type":"application/json"
-	}) 
+	}, idempotent=True) 
+	# So a failed request in a batch shows up in the manifest with the API's message
+	raiseForStatus(response)
 
 	return response.json()
 
+# Generates (or pulls from the cache) and saves the results, named by the prompt, style, and seed
+def generate(prompt, num, styles, seeds, namePrefix, size="2048x2048", contentClass="photo"):
+
+	data = buildRequest(prompt, num, styles, seeds, size, contentClass)
+
+	# Only get a token if we actually have to call the API. It's cached on disk as well, so
+	# repeated runs don't need to go back to IMS each time.
+	def call():
+		return textToImage(data, CLIENT_ID, getFFAccessToken(CLIENT_ID, CLIENT_SECRET))
+
+	def nameFor(resp):
+		newName = namePrefix + "-" + str(resp["seed"]) + ".jpg"
+		print(f"Saving {newName}")
+		return newName
+
+	response, saved, cached = cache.fetch(GENERATE_URL, data, call, nameFor)
+	if cached:
+		print("(Reused cached results)")
+	return saved, cached
+
+# Generates every style at the same time, and each style's images download as soon as it's done
+# while the rest are still generating. The grid of styles x seeds is written to
+# output/<prompt>-styles.json.
+def sweepStyles(prompt, num, styles, seeds):
+
+	namePrefix = "output/" + slugify(prompt)
+
+	def nameFor(style, output):
+		return namePrefix + "-" + style + "-" + str(output["seed"]) + ".jpg"
+
+	def generateStyle(style):
+		data = buildRequest(prompt, num, [style], seeds)
+		restored = cache.restore(GENERATE_URL, data, lambda output: nameFor(style, output))
+		if restored is not None:
+			return restored
+		return textToImage(data, CLIENT_ID, getFFAccessToken(CLIENT_ID, CLIENT_SECRET))
+
+	def onSaved(style, response, saved):
+		cache.save(GENERATE_URL, buildRequest(prompt, num, [style], seeds), response, saved)
+
+	rows = StyleSweep(workers=batchWorkers).run(styles, generateStyle, nameFor, onSaved)
+	manifestPath = writeManifest(namePrefix + "-styles.json", rows, prompt=prompt, num=num, seeds=seeds)
+
+	failed = sum(1 for row in rows if "error" in row)
+	print(f"Wrote the grid to {manifestPath}, {len(rows) - failed} style(s) succeeded and {failed} failed")
+
+# Each line of a batch file is a JSON object like the arguments below, ex:
+# {"prompt":"a cat on a skateboard", "num":2, "styles":["art"], "size":"1024x1024", "contentClass":"art", "seeds":[1,2]}
+# Only prompt is required. Like on the command line, each style is generated separately. Any bad
+# lines are all reported before anything runs, rather than failing part way through a batch.
+def readBatch(path):
+	units = []
+	errors = []
+	with open(path, "r") as file:
+		for (line, text) in enumerate(file, start=1):
+			if not text.strip():
+				continue
+			try:
+				entry = json.loads(text)
+				if not isinstance(entry, dict) or not entry.get("prompt"):
+					raise ValueError("needs a prompt")
+			except ValueError as e:
+				errors.append(f"{path} line {line}: {e}")
+				continue
+			size = entry.get("size", "2048x2048")
+			if isinstance(size, dict):
+				size = f"{size['width']}x{size['height']}"
+			for style in entry.get("styles") or [None]:
+				units.append({
+					"line":line,
+					"prompt":entry["prompt"],
+					"num":entry.get("num", 1),
+					"style":style,
+					"size":size,
+					"contentClass":entry.get("contentClass", "photo"),
+					"seeds":entry.get("seeds")
+				})
+
+	if errors:
+		print("\n".join(errors))
+		sys.exit(f"Fix the {len(errors)} bad line(s) above and run the batch again")
+	return units
+
+def runUnit(unit):
+	namePrefix = "output/" + slugify(unit["prompt"])
+	if unit["style"]:
+		namePrefix += "-" + unit["style"]
+	if unit["size"] != "2048x2048":
+		namePrefix += "-" + unit["size"]
+	return generate(unit["prompt"], unit["num"], [unit["style"]] if unit["style"] else None, unit["seeds"], namePrefix, unit["size"], unit["contentClass"])
+
+# Runs every request in the batch file on a pool of workers, all sharing one token and connection
+# pool. Each result is written to the manifest (one JSON line per request) the moment it finishes,
+# so the manifest is useful even if the batch is stopped part way.
+def runBatch(path, manifestPath):
+	units = readBatch(path)
+	print(f"Running {len(units)} request(s) from {path}, {batchWorkers} at a time")
+
+	if client.settings["poolSize"] < batchWorkers:
+		client.configure(poolSize=batchWorkers)
+
+	# Get the token once up front, rather than every worker racing to
+	getFFAccessToken(CLIENT_ID, CLIENT_SECRET)
+
+	def timed(unit):
+		start = time.monotonic()
+		saved, cached = runUnit(unit)
+		return saved, cached, time.monotonic() - start
+
+	failed = 0
+	with open(manifestPath, "a") as manifest, ThreadPoolExecutor(max_workers=batchWorkers) as executor:
+		futures = { executor.submit(timed, unit):unit for unit in units }
+		for future in as_completed(futures):
+			unit = futures[future]
+			entry = { "line":unit["line"], "prompt":unit["prompt"], "style":unit["style"], "size":unit["size"] }
+			try:
+				saved, cached, seconds = future.result()
+				entry.update({ "files":saved, "cached":cached, "seconds":round(seconds, 2) })
+			except Exception as e:
+				failed += 1
+				entry["error"] = str(e)
+				print(f"Line {unit['line']} failed: {e}")
+			manifest.write(json.dumps(entry) + "\n")
+			manifest.flush()
+
+	print(f"Wrote results to {manifestPath}, {len(units) - failed} succeeded and {failed} failed")
+
 
 if len(sys.argv) < 2:
-	print("Usage: python3 test2.py \"prompt\" numberOfImages (defaults to 1) styleIds (comma separated list) ")
+	print("Usage: python3 t2i.py \"prompt\" numberOfImages (defaults to 1) styleIds (comma separated list) seeds (comma separated list)")
+	print("   or: python3 t2i.py --batch requests.jsonl manifest.jsonl (defaults to output/manifest.jsonl)")
+	sys.exit()
+
+if sys.argv[1] == "--batch":
+	runBatch(sys.argv[2], sys.argv[3] if len(sys.argv) >= 4 else "output/manifest.jsonl")
+	print("\nDone")
 	sys.exit()
 
 prompt = sys.argv[1]
 
 if len(sys.argv) >= 3:
-	num = sys.argv[2]
+	num = int(sys.argv[2])
 else:
 	num = 1
 
-if len(sys.argv) >= 4:
+if len(sys.argv) >= 4 and sys.argv[3]:
 	styles = sys.argv[3].split(',')
 else:
 	styles = None
 
-print(f"Generating {num} image(s) based on prompt: {prompt}")
+if len(sys.argv) >= 5:
+	seeds = [int(seed) for seed in sys.argv[4].split(',')]
+else:
+	seeds = None
 
-accessToken = getAccessToken(CLIENT_ID, CLIENT_SECRET)['access_token']
+print(f"Generating {num} image(s) based on prompt: {prompt}")
 
 if styles:
 
 	# So you CAN pass an array of styles, but I don't know how it's supposed to work
-	# when passing different styles, so we're going to do one at  atime
-	for style in styles:
-		print(f"Generating for style {style}")
-		response = textToImage(prompt, num, [style] , CLIENT_ID, accessToken)
-
-		# So, assume a good response, and loop over response.outputs
-		for resp in response["outputs"]:
-			# todo, make new file based on slug of prompt + seed
-			newName = "output/" + slugify(prompt) + "-" + style + "-" + str(resp["seed"]) + ".jpg"
-			imgUrl = resp["image"]["presignedUrl"]
-			print(f"Saving {newName}")
-			with open(newName,'wb') as output:
-				bits = requests.get(imgUrl, stream=True).content
-				output.write(bits)
+	# when passing different styles, so each style is its own request, all sent at once
+	sweepStyles(prompt, num, styles, seeds)
 
 else:
 	
-	response = textToImage(prompt, num, styles , CLIENT_ID, accessToken)
-	for resp in response["outputs"]:
-		# todo, make new file based on slug of prompt + seed
-		newName = "output/" + slugify(prompt) + "-" + str(resp["seed"]) + ".jpg"
-		imgUrl = resp["image"]["presignedUrl"]
-		print(f"Saving {newName}")
-		with open(newName,'wb') as output:
-			bits = requests.get(imgUrl, stream=True).content
-			output.write(bits)
+	generate(prompt, num, styles, seeds, "output/" + slugify(prompt))
 
 
 print("\nDone")
\ No newline at end of file
@@ -1,13 +1,14 @@
 import os 
-import requests 
 import json
 from slugify import slugify
+from ffservices import client
+from ffservices.download import downloadFile
 
 CLIENT_ID = os.environ.get('CLIENT_ID')
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 
 def getAccessToken(id, secret):
-	response = requests.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api,ff_apis")
+	response = client.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api,ff_apis")
 	return response.json()
 
 def textToImage(text, id, token):
@@ -22,7 +23,7 @@ def textToImage(text, id, token):
 		}
 	}
 
-	response = requests.post("https://firefly-api.adobe.io/v2/images/generate", json=data, headers = {
+	response = client.post("https://firefly-api.adobe.io/v2/images/generate", json=data, headers = {
 		"X-API-Key":id, 
 		"Authorization":f"Bearer {token}",
 		"Content-Type":"application/json"
@@ -46,8 +47,6 @@ for resp in response["outputs"]:
 	newName = slugify(prompt) + "-" + str(resp["seed"]) + ".jpg"
 	imgUrl = resp["image"]["presignedUrl"]
 	print(f"Saving {newName}")
-	with open(newName,'wb') as output:
-		bits = requests.get(imgUrl, stream=True).content
-		output.write(bits)
+	downloadFile(imgUrl, newName)
 
 print("\nDone")
\ No newline at end of file
@@ -5,16 +5,18 @@
 # pass in the styles via arguments.
 
 import os 
-import requests 
 import json
 import sys
 from slugify import slugify
+from ffservices import client
+from ffservices.retry import raiseForStatus
+from ffservices.sweep import StyleSweep, writeManifest
 
 CLIENT_ID = os.environ.get('CLIENT_ID')
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 
 def getAccessToken(id, secret):
-	response = requests.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api")
+	response = client.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api")
 	return response.json()
 
 def textToImage(text, num, styles, id, token):
@@ -32,11 +34,12 @@ def textToImage(text, num, styles, id, token):
 		}
 	}
 
-	response = requests.post("https://firefly-beta.adobe.io/v2/images/generate", json=data, headers = {
+	response = client.post("https://firefly-beta.adobe.io/v2/images/generate", json=data, headers = {
 		"X-API-Key":id, 
 		"Authorization":f"Bearer {token}",
 		"Content-Type":"application/json"
-	}) 
+	}, idempotent=True) 
+	raiseForStatus(response)
 
 	return response.json()
 
@@ -44,7 +47,7 @@ def textToImage(text, num, styles, id, token):
 styles = ["photo","art","graphic", "bw", "cool_colors", "golden", "muted_color", "pastel_color", "toned_image", "vibrant_colors", "warm_tone", "closeup", "knolling", "landscape_photography", "macrophotography", "photographed_through_window", "shallow_depth_of_field", "shot_from_above", "shot_from_below", "surface_detail", "wide_angle", "beautiful", "bohemian", "chaotic", "dais", "divine", "electric", "futuristic", "kitschy", "nostalgic", "simple", "antique_photo", "bioluminescent", "bokeh", "color_explosion", "dark", "faded_image", "fisheye"]
 
 if len(sys.argv) < 2:
-	print("Usage: python3 test2.py \"prompt\"")
+	print("Usage: python3 text_to_image_multiple_style.py \"prompt\"")
 	sys.exit()
 
 prompt = sys.argv[1]
@@ -53,19 +56,16 @@ print(f"Generating images based on prompt: {prompt}")
 accessToken = getAccessToken(CLIENT_ID, CLIENT_SECRET)['access_token']
 
 # So you CAN pass an array of styles, but I don't know how it's supposed to work
-# when passing different styles, so we're going to do one at  atime
-for style in styles:
-	print(f"Generating for style {style}")
-	response = textToImage(prompt, 2, [style] , CLIENT_ID, accessToken)
+# when passing different styles, so each style is its own request. They all go out at once
+# (FF_CONCURRENCY at a time), and each style's images download while the rest are generating.
+def nameFor(style, output):
+	return "output/" + slugify(prompt) + "-" + style + "-" + str(output["seed"]) + ".jpg"
 
-	# So, assume a good response, and loop over response.outputs
-	for resp in response["outputs"]:
-		# todo, make new file based on slug of prompt + seed
-		newName = "output/" + slugify(prompt) + "-" + style + "-" + str(resp["seed"]) + ".jpg"
-		imgUrl = resp["image"]["presignedUrl"]
-		print(f"Saving {newName}")
-		with open(newName,'wb') as output:
-			bits = requests.get(imgUrl, stream=True).content
-			output.write(bits)
+sweep = StyleSweep(workers=int(os.environ.get('FF_CONCURRENCY', 8)))
+rows = sweep.run(styles, lambda style: textToImage(prompt, 2, [style], CLIENT_ID, accessToken), nameFor)
 
-print("\nDone")
\ No newline at end of file
+# Every style and seed in one place, for building a comparison grid
+manifestPath = writeManifest("output/" + slugify(prompt) + "-styles.json", rows, prompt=prompt)
+print(f"Wrote the grid to {manifestPath}")
+
+print("\nDone")
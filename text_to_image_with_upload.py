@@ -1,23 +1,24 @@
 # This script demos using reference images
 
 import os 
-import requests 
 import json
 import sys
 from slugify import slugify
+from ffservices import client
+from ffservices.download import DownloadManager
 
 CLIENT_ID = os.environ.get('CLIENT_ID')
 CLIENT_SECRET = os.environ.get('CLIENT_SECRET')
 
 def getAccessToken(id, secret):
-	response = requests.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api")
+	response = client.post(f"https://ims-na1.adobelogin.com/ims/token/v3?client_id={id}&client_secret={secret}&grant_type=client_credentials&scope=openid,AdobeID,firefly_enterprise,firefly_api")
 	return response.json()
 
 def uploadImage(path, id, token):
 	
 	with open(path,'rb') as file:
 
-		response = requests.post("https://firefly-beta.adobe.io/v2/storage/image", data=file, headers = {
+		response = client.post("https://firefly-beta.adobe.io/v2/storage/image", data=file, headers = {
 			"X-API-Key":id, 
 			"Authorization":f"Bearer {token}",
 			"Content-Type": "image/jpeg"
@@ -41,7 +42,7 @@ def textToImage(text, imageId, id, token):
 		}
 	}
 
-	response = requests.post("https://firefly-beta.adobe.io/v2/images/generate", json=data, headers = {
+	response = client.post("https://firefly-beta.adobe.io/v2/images/generate", json=data, headers = {
 		"X-API-Key":id, 
 		"Authorization":f"Bearer {token}",
 		"Content-Type":"application/json"
@@ -63,13 +64,15 @@ response = textToImage(prompt, imageId , CLIENT_ID, accessToken)
 
 # So, assume a good response, and loop over response.outputs
 
+# All the results download in parallel
+downloads = DownloadManager()
 for resp in response["outputs"]:
 	# todo, make new file based on slug of prompt + seed
 	newName = "output/" + slugify(prompt) + "-" + str(resp["seed"]) + ".jpg"
 	imgUrl = resp["image"]["presignedUrl"]
 	print(f"Saving {newName}")
-	with open(newName,'wb') as output:
-		bits = requests.get(imgUrl, stream=True).content
-		output.write(bits)
+	downloads.add(imgUrl, newName)
 
+downloads.wait()
+print(downloads.summary())
 print("\nDone")
\ No newline at end of file